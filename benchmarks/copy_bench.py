@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from schemas.wire import BINARY_FIELD_BYTES, pack_reading, text_records, binary_records, decode_entries
+from schemas.pg_copy import encode_copy
+
+SIZES = (1_000, 10_000, 100_000)
+COLUMNS = ('id', 'reading', 'timestamp')
+
+def make_bodies(rows: int) -> list[bytes]:
+    """ROWS JSON bodies shaped like the Locust tests send them"""
+    return [json.dumps({'id': i, 'reading': random.randint(-32768, 32767)}).encode() for i in range(rows)]
+
+def make_entries(rows: int) -> tuple[list[dict], list[dict]]:
+    """
+    Builds ROWS stream entries as the worker receives them, in both wire formats
+    Text entries are str dicts (decode_responses), binary entries are raw bytes dicts
+    """
+    start = datetime.now(timezone.utc)
+    text = []
+    binary = []
+    for i in range(rows):
+        reading = random.randint(-32768, 32767)
+        timestamp = start + timedelta(microseconds=i)
+        text.append({'id': str(i), 'reading': str(reading), 'timestamp': timestamp.isoformat()})
+        binary.append({BINARY_FIELD_BYTES: pack_reading(i, reading, timestamp)})
+    return text, binary
+
+def best_of(repeat: int, func, *args) -> float:
+    """Best wall time in seconds of REPEAT calls, the minimum is the least noisy estimate for CPU bound code"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        func(*args)
+        best = min(best, perf_counter() - start)
+    return best
+
+def encode_paths(text: list[dict], binary: list[dict]) -> dict:
+    """
+    The CPU work each path does before rows reach asyncpg, per wire format
+    records: list of (id, reading, datetime) tuples for copy_records_to_table (the current path)
+    binary_copy: decoded columns written into a preallocated binary COPY buffer for copy_to_table
+    """
+    return {
+        'text/records': lambda: text_records(text),
+        'text/binary_copy': lambda: encode_copy(decode_entries(text, binary=False)),
+        'binary/records': lambda: binary_records(binary),
+        'binary/binary_copy': lambda: encode_copy(decode_entries(binary, binary=True)),
+    }
+
+def copy_runs(conn, table: str, text: list[dict], binary: list[dict]) -> dict:
+    """
+    The full COPY of every path into TABLE over CONN, keyed like encode_paths, each call returns the awaitable COPY
+    Rows are converted inside the call, as the worker does for every batch
+    """
+    return {
+        'text/records': lambda: conn.copy_records_to_table(table, records=text_records(text), columns=COLUMNS),
+        'text/binary_copy': lambda: conn.copy_to_table(table, source=encode_copy(decode_entries(text, binary=False)), columns=COLUMNS, format='binary'),
+        'binary/records': lambda: conn.copy_records_to_table(table, records=binary_records(binary), columns=COLUMNS),
+        'binary/binary_copy': lambda: conn.copy_to_table(table, source=encode_copy(decode_entries(binary, binary=True)), columns=COLUMNS, format='binary'),
+    }
+
+async def copy_paths(text: list[dict], binary: list[dict], repeat: int) -> dict:
+    """
+    Full COPY into a temporary copy of readings for every path, including asyncpg's own per record encoding
+    """
+    from config.config import settings
+    from config.database_config import create_async_db_pool
+
+    pool = await create_async_db_pool(settings.USER, settings.DATABASE, settings.HOST, settings.PORT, settings.DATABASE_PASS, 1, 1)
+    results = {}
+    async with pool.acquire() as conn:
+        await conn.execute('CREATE TEMP TABLE IF NOT EXISTS copy_bench (LIKE readings INCLUDING DEFAULTS)') # no indexes, so only the COPY itself is measured
+        for name, copy in copy_runs(conn, 'copy_bench', text, binary).items():
+            best = float('inf')
+            for _ in range(repeat):
+                await conn.execute('TRUNCATE copy_bench')
+                start = perf_counter()
+                await copy()
+                best = min(best, perf_counter() - start)
+            results[name] = best
+    await pool.close()
+    return results
+
+def report(title: str, rows: int, results: dict) -> None:
+    print(f'{title} ({rows:,} rows)')
+    baseline = results['text/records'] # the current default path
+    for name, seconds in results.items():
+        print(f'  {name:<20} {seconds * 1000:9.2f} ms  {rows / seconds:14,.0f} rows/s  {baseline / seconds:5.1f}x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares copy_records_to_table record building with the binary COPY fast path')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best is reported (default: 5)')
+    parser.add_argument('--db', action='store_true', help='also time the full COPY against the configured database')
+    args = parser.parse_args()
+
+    for rows in SIZES:
+        text, binary = make_entries(rows)
+        report('Encode', rows, {name: best_of(args.repeat, path) for name, path in encode_paths(text, binary).items()})
+        if args.db:
+            report('COPY', rows, asyncio.run(copy_paths(text, binary, args.repeat)))
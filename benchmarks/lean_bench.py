@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+from time import process_time
+
+from benchmarks.copy_bench import make_bodies
+from main import app
+
+ENDPOINTS = ('/readings/fast', '/readings/fast/lean')
+
+class NullProducer:
+    """Stands in for Redis so only the API process' own CPU work is measured"""
+    async def xadd(self, name: str, fields: dict) -> None:
+        return None
+
+async def call(path: str, body: bytes) -> int:
+    """
+    Sends one POST straight into the ASGI app, the way uvicorn would, and returns the status code
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 8000),
+    }
+    status = 0
+
+    async def receive() -> dict:
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+async def cpu_per_request(path: str, bodies: list[bytes], repeat: int) -> float:
+    """
+    Best CPU seconds per request over REPEAT passes through every body, process_time ignores time spent waiting
+    """
+    for body in bodies[:100]: # warm up routing and validator caches
+        await call(path, body)
+    best = float('inf')
+    for _ in range(repeat):
+        start = process_time()
+        for body in bodies:
+            status = await call(path, body)
+            assert status == 200, f'{path} returned {status}'
+        best = min(best, (process_time() - start) / len(bodies))
+    return best
+
+async def main(requests: int, repeat: int) -> None:
+    app.state.producer = NullProducer()
+    bodies = make_bodies(requests)
+    results = {path: await cpu_per_request(path, bodies, repeat) for path in ENDPOINTS}
+    baseline = results['/readings/fast'] # the current handler
+    print(f'CPU per request ({requests:,} requests, best of {repeat})')
+    for path, seconds in results.items():
+        print(f'  {path:<22} {seconds * 1e6:8.1f} us  {1 / seconds:10,.0f} requests/s per core  {baseline / seconds:5.2f}x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the per request CPU cost of /readings/fast and /readings/fast/lean in process, without Redis')
+    parser.add_argument('--requests', type=int, default=20000, help='requests per pass (default: 20000)')
+    parser.add_argument('--repeat', type=int, default=5, help='passes per endpoint, the best is reported (default: 5)')
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.repeat))
@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+from datetime import datetime, timezone
+from time import perf_counter, time_ns
+
+from benchmarks.copy_bench import make_bodies, make_entries, encode_paths, copy_runs, best_of
+from schemas.db_model import DatabasePayload, parse_batch, parse_lean
+from schemas.wire import BINARY_FIELD, pack_reading
+from services.coalescer import XaddCoalescer
+
+# Every stage reports a throughput (higher is better) under a stage/variant name, so runs can be compared by name
+STAGES = ('validation', 'conversion', 'xadd', 'copy', 'drain')
+COPY_SIZES = (100, 1_000, 10_000)
+
+class StubPipeline:
+    """Pipeline of StubRedis, queues XADDs and answers them all on execute"""
+    def __init__(self, redis: 'StubRedis') -> None:
+        self.redis = redis
+        self.commands: list[tuple[str, dict]] = []
+
+    async def __aenter__(self) -> 'StubPipeline':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.commands = []
+
+    def xadd(self, name: str, fields: dict) -> None:
+        self.commands.append((name, fields))
+
+    async def execute(self, raise_on_error: bool = True) -> list[str]:
+        results = [self.redis.add(name, fields) for name, fields in self.commands]
+        self.commands = []
+        return results
+
+class StubRedis:
+    """
+    Stands in for Redis with the commands the producers use, entries are counted and dropped
+    Measures what the API process itself spends per XADD mode, without the network or the Redis server
+    """
+    def __init__(self) -> None:
+        self.sequence: int = 0
+
+    def add(self, name: str, fields: dict) -> str:
+        self.sequence += 1
+        return f'0-{self.sequence}'
+
+    async def xadd(self, name: str, fields: dict) -> str:
+        return self.add(name, fields)
+
+    def pipeline(self, transaction: bool = True) -> StubPipeline:
+        return StubPipeline(self)
+
+    async def delete(self, *names: str) -> int:
+        return 0
+
+def make_fields(rows: int, binary: bool, base: int = 0) -> list[dict]:
+    """ROWS stream entries as /readings/fast builds them, ids start at BASE"""
+    now = datetime.now(timezone.utc)
+    if binary:
+        return [{BINARY_FIELD: pack_reading(base + i, random.randint(-32768, 32767), now)} for i in range(rows)]
+    timestamp = now.isoformat()
+    return [{'id': base + i, 'reading': random.randint(-32768, 32767), 'timestamp': timestamp} for i in range(rows)]
+
+def bench_validation(rows: int, repeat: int) -> dict:
+    """
+    Payloads validated per second: the model /readings/fast validates with, the lean inline check and a batch body
+    """
+    bodies = make_bodies(rows)
+    ndjson = b'\n'.join(bodies)
+
+    def model() -> None:
+        for body in bodies:
+            DatabasePayload.model_validate_json(body)
+
+    def lean() -> None:
+        for body in bodies:
+            parse_lean(body)
+
+    return {
+        'validation/model': rows / best_of(repeat, model),
+        'validation/lean': rows / best_of(repeat, lean),
+        'validation/batch_ndjson': rows / best_of(repeat, parse_batch, ndjson),
+    }
+
+def bench_conversion(rows: int, repeat: int) -> dict:
+    """
+    Stream entries converted per second into what the worker hands asyncpg, per wire format and COPY path
+    """
+    text, binary = make_entries(rows)
+    return {f'conversion/{name}': rows / best_of(repeat, path) for name, path in encode_paths(text, binary).items()}
+
+async def timed(repeat: int, run, cleanup) -> float:
+    """Best wall time in seconds of REPEAT awaited RUN() calls, awaiting CLEANUP() before each"""
+    best = float('inf')
+    for _ in range(repeat):
+        await cleanup()
+        start = perf_counter()
+        await run()
+        best = min(best, perf_counter() - start)
+    await cleanup()
+    return best
+
+async def bench_xadd(client, rows: int, repeat: int, concurrency: int) -> dict:
+    """
+    Entries written per second by each XADD mode the API has, with CONCURRENCY requests in flight
+    single: one XADD per request (/readings/fast), binary: the same with WIRE_FORMAT binary entries,
+    pipelined: 1000 entries per round trip (/readings/fast/batch), coalesced: XADD_COALESCE with its default settings
+    With fewer requests in flight than COALESCE_MAX_BATCH, coalesced includes the window every batch waits out
+    """
+    stream = f'bench:xadd:{time_ns()}'
+    text = make_fields(rows, binary=False)
+    packed = make_fields(rows, binary=True)
+
+    async def cleanup() -> None:
+        await client.delete(stream)
+
+    async def single(entries: list[dict], xadd) -> None:
+        async def requests(share: list[dict]) -> None:
+            for fields in share:
+                await xadd(stream, fields)
+        await asyncio.gather(*(requests(entries[i::concurrency]) for i in range(concurrency)))
+
+    async def pipelined() -> None:
+        for i in range(0, rows, 1000):
+            async with client.pipeline(transaction=False) as pipe:
+                for fields in text[i:i + 1000]:
+                    pipe.xadd(stream, fields)
+                await pipe.execute()
+
+    async def coalesced() -> None:
+        coalescer = XaddCoalescer(client, 0.002, 256)
+        coalescer.start()
+        try:
+            await single(text, coalescer.xadd)
+        finally:
+            await coalescer.stop()
+
+    return {
+        'xadd/single': rows / await timed(repeat, lambda: single(text, client.xadd), cleanup),
+        'xadd/binary': rows / await timed(repeat, lambda: single(packed, client.xadd), cleanup),
+        'xadd/pipelined': rows / await timed(repeat, pipelined, cleanup),
+        'xadd/coalesced': rows / await timed(repeat, coalesced, cleanup),
+    }
+
+async def bench_copy(conn, repeat: int) -> dict:
+    """
+    Rows copied per second by batch size, for copy_records_to_table (records) and the binary COPY buffer (binary_copy)
+    Uses copy_bench's text wire paths, whose entries are converted inside the timing as the worker does for every batch
+    """
+    await conn.execute('CREATE TEMP TABLE IF NOT EXISTS bench_copy (LIKE readings INCLUDING DEFAULTS)') # no indexes, so only the COPY itself is measured
+
+    async def truncate() -> None:
+        await conn.execute('TRUNCATE bench_copy')
+
+    results = {}
+    for size in COPY_SIZES:
+        runs = copy_runs(conn, 'bench_copy', *make_entries(size))
+        for path in ('records', 'binary_copy'):
+            results[f'copy/{path}/{size}'] = size / await timed(repeat, runs[f'text/{path}'], truncate)
+    return results
+
+def run_worker(stream: str) -> float:
+    """
+    Runs the worker (python -m workers.worker) in DRAIN_ONLY mode over STREAM until it exits, returns its wall time
+    Everything else comes from the current configuration, so the drain is measured with the settings being tuned
+    """
+    env = {**os.environ, 'STREAM_NAME': stream, 'CONSUMER_GROUP': 'bench', 'CONSUMER_NAME': 'bench1', 'DRAIN_ONLY': 'true',
+           'CLEAR_STREAM': 'true', 'CLEAR_DB': 'false', 'CLEAR_LOG': 'false', 'METRICS_PORT': '0', 'TRACE_SAMPLE_RATE': '0'}
+    start = perf_counter()
+    subprocess.run([sys.executable, '-m', 'workers.worker'], env=env, check=True, stdout=subprocess.DEVNULL)
+    return perf_counter() - start
+
+async def bench_drain(rows: int) -> dict:
+    """
+    Entries drained per second by the real worker from a preloaded stream into readings, COPY and XACK included
+    The worker's startup and shutdown time is measured on an empty stream and subtracted
+    Writes ROWS readings into the configured database with ids from the current time, so use a benchmark database
+    """
+    from config.config import settings
+    from config.redis_config import redis_client
+
+    stream = f'bench:drain:{time_ns()}'
+    base = time_ns() // 1000 # moves on by 1,000,000 ids per second, so runs never collide with each other
+    entries = make_fields(rows, settings.WIRE_FORMAT == 'binary', base)
+    for i in range(0, rows, 1000):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for fields in entries[i:i + 1000]:
+                pipe.xadd(stream, fields) # type: ignore
+            await pipe.execute()
+
+    overhead = await asyncio.to_thread(run_worker, f'{stream}:empty')
+    elapsed = await asyncio.to_thread(run_worker, stream)
+    await redis_client.delete(stream, f'{stream}:empty') # already gone unless the worker failed
+    return {'drain/worker': rows / max(elapsed - overhead, 1e-9)}
+
+async def run(stages: list[str], backend: str, rows: int, repeat: int, concurrency: int) -> dict:
+    """
+    Runs the selected STAGES against BACKEND: stub uses StubRedis and skips the copy and drain stages, local the configured Redis and Postgres
+    """
+    results: dict[str, float] = {}
+    if 'validation' in stages:
+        results.update(bench_validation(rows, repeat))
+    if 'conversion' in stages:
+        results.update(bench_conversion(rows, repeat))
+
+    if backend == 'stub':
+        if 'xadd' in stages:
+            results.update(await bench_xadd(StubRedis(), rows, repeat, concurrency))
+        if 'copy' in stages: # a stub connection would drop the records before asyncpg encodes them, favouring records over binary_copy
+            print('Skipping copy, it needs asyncpg\'s own encoding and Postgres, use --backend local (conversion covers the CPU side)')
+        if 'drain' in stages:
+            print('Skipping drain, it runs the real worker and needs --backend local')
+        return results
+
+    from config.config import settings
+    from config.database_config import create_async_db_pool
+    from config.redis_config import redis_client
+
+    if 'xadd' in stages:
+        results.update(await bench_xadd(redis_client, rows, repeat, concurrency))
+    if 'copy' in stages:
+        pool = await create_async_db_pool(settings.USER, settings.DATABASE, settings.HOST, settings.PORT, settings.DATABASE_PASS, 1, 1)
+        async with pool.acquire() as conn:
+            results.update(await bench_copy(conn, repeat))
+        await pool.close()
+    if 'drain' in stages:
+        results.update(await bench_drain(rows))
+    await redis_client.aclose()
+    return results
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """
+    Prints the change of every result the two runs share, returns the names that dropped by more than THRESHOLD (a fraction)
+    """
+    regressions = []
+    print(f'Compared with the baseline from {baseline["created"]} (threshold {threshold:.0%})')
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f'  {name:<28} {result["value"]:14,.0f} {result["unit"]:<10} new')
+            continue
+        change = result['value'] / before['value'] - 1
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(name)
+        print(f'  {name:<28} {result["value"]:14,.0f} {result["unit"]:<10} {change:+7.1%}{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+def unit(name: str) -> str:
+    """Throughput unit of a result name"""
+    return {'validation': 'payloads/s', 'xadd': 'entries/s', 'drain': 'entries/s'}.get(name.split('/')[0], 'rows/s')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures each ingestion stage on its own and writes the results as JSON')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f'comma separated stages to run (default: {",".join(STAGES)})')
+    parser.add_argument('--backend', choices=('stub', 'local'), default='stub',
+                        help='stub runs without services, local uses the configured Redis and Postgres (default: stub)')
+    parser.add_argument('--rows', type=int, default=10000, help='payloads, entries or rows per measurement (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best is reported (default: 5)')
+    parser.add_argument('--concurrency', type=int, default=64, help='requests in flight in the xadd stage (default: 64)')
+    parser.add_argument('--output', default='bench_results.json', help='JSON results file (default: bench_results.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file of an earlier run, exits 1 if any shared stage regressed')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed throughput drop against the baseline (default: 0.1, i.e. 10%%)')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f'unknown stages: {", ".join(sorted(unknown))}')
+
+    results = asyncio.run(run(stages, args.backend, args.rows, args.repeat, args.concurrency))
+    current = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'backend': args.backend,
+        'rows': args.rows,
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': {name: {'value': value, 'unit': unit(name)} for name, value in results.items()},
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(current, file, indent=2)
+    print(f'Results ({args.backend} backend, {args.rows:,} rows, best of {args.repeat}) written to {args.output}')
+    for name, result in current['results'].items():
+        print(f'  {name:<28} {result["value"]:14,.0f} {result["unit"]}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline['backend'] != args.backend or baseline['rows'] != args.rows:
+            sys.exit(f'Baseline ran with the {baseline["backend"]} backend and {baseline["rows"]:,} rows, rerun with the same settings to compare')
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            sys.exit(f'{len(regressions)} stages regressed by more than {args.threshold:.0%}: {", ".join(regressions)}')
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class AppSettings(BaseSettings):
@@ -12,18 +14,80 @@ class AppSettings(BaseSettings):
     MAX_SIZE: int = 10 # Maximum number of connections asyncpg connection pool is initialized with
     CLEAR_DB: bool = False # Automatically clear the database on startup
     CLEAR_DB2: bool = False # Automatically clears the readings2 (process safe) database on startup
+    CONFLICT_MODE: Literal['fallback', 'staging'] = 'fallback' # readings duplicates: fallback retries a failed COPY through a staging table, staging always uses it
+    PARTITIONING: bool = False # manage readings and readings2 as tables range partitioned on timestamp (see config/partitions.py)
+    PARTITION_INTERVAL: Literal['day', 'hour'] = 'day' # time range covered by each partition
+    PARTITION_PREMAKE: int = 3 # partitions created ahead of the current one
+    PARTITION_RETENTION: int = 0 # past partitions kept besides the current one before they are dropped, 0 keeps everything
+    PARTITION_MAINTENANCE_INTERVAL: float = 600 # time in seconds between partition maintenance passes in the worker
+    ROLLUP: bool = False # worker also maintains per device per minute count/sum/min/max in readings_1m, served by /readings/rollups
+    BINARY_COPY_TABLES: list[str] = [] # tables the workers COPY into with a prebuilt binary COPY buffer, e.g. ["readings", "readings2"]
 
     # Logging settings:
     VERBOSE: bool = False # Enable debug messages for tracking event loop
+    TRACE_SAMPLE_RATE: float = 0 # fraction of requests and worker batches traced into an in-memory ring buffer, 0 disables tracing
+    TRACE_CAPACITY: int = 100000 # events kept in the ring buffer between dumps
+    TRACE_FILE: str = 'trace.log' # traces are appended here as debug log lines the visualizer reads, on SIGUSR1, periodically and at shutdown
+    TRACE_DUMP_INTERVAL: float = 10 # time in seconds between trace dumps, 0 dumps only on SIGUSR1 and at shutdown
+    METRICS: bool = True # Prometheus metrics: /metrics on the API, an HTTP port on each worker (see config/metrics.py)
+    METRICS_PORT: int = 9100 # worker metrics port, fleet processes use METRICS_PORT + their index, 0 disables it
+    METRICS_HOST: str = '127.0.0.1' # interface the worker metrics port listens on, 0.0.0.0 lets a remote Prometheus scrape it
     CLEAR_LOG: bool = True # Automatically clear the debug.log on startup
     
     # Redis settings:
     STREAM_NAME: str = 'db_buffer'
+    SHARD_COUNT: int = 1 # number of streams readings are spread over by device id (STREAM_NAME:0 ... STREAM_NAME:N-1), 1 uses STREAM_NAME itself
     CONSUMER_GROUP: str = 'workers'
     CONSUMER_NAME: str = 'worker1'
     CLEAR_STREAM: bool = False # clears the redis stream at shutdown of worker
     BUFFER: int = 100 # minimum number of requests until the worker automatically flushes
     BUFFER_TIME: float = 1 # time in seconds until the worker automatically flushes
+    ADAPTIVE_FLUSH: bool = False # size batches and flush deadlines from measured arrival rate and COPY latency instead of BUFFER/BUFFER_TIME
+    FLUSH_LATENCY_SLO: float = 0.5 # adaptive mode: target time in seconds from reading an entry to committing it
+    FLUSH_MAX_BATCH: int = 10000 # adaptive mode: largest batch the worker will buffer before flushing
+    CLAIM_INTERVAL: float = 30 # time in seconds between XAUTOCLAIM passes over the pending entries list
+    CLAIM_MIN_IDLE: float = 60 # time in seconds an entry must sit unacknowledged before another consumer takes it over
+    MAX_DELIVERIES: int = 5 # times an entry may be delivered before it is moved to DEAD_LETTER_STREAM instead of retried, 0 retries forever
+    DEAD_LETTER_STREAM: str = 'dead_letters' # entries no worker could write, with their source stream and entry id
+    TRIM_INTERVAL: float = 5 # time in seconds between trims of acknowledged entries from the stream, 0 never trims
+    DRAIN_ONLY: bool = False # worker exits once its stream has nothing undelivered or pending, used to retire old shards after a resize
+    PIPELINE_FLUSHERS: int = 0 # number of concurrent COPY + XACK tasks per worker, 0 reads and flushes serially. Keep at most MAX_SIZE
+    PIPELINE_MAX_IN_FLIGHT: int = 4 # full buffers allowed to wait for a flusher before the worker stops reading (backpressure)
+    XADD_COALESCE: bool = False # coalesce concurrent /readings/fast XADDs into one pipelined round trip
+    COALESCE_WINDOW: float = 0.002 # time in seconds the coalescer waits for more requests before flushing
+    COALESCE_MAX_BATCH: int = 256 # number of queued requests that triggers an immediate coalescer flush
+    WIRE_FORMAT: Literal['text', 'binary'] = 'text' # binary packs each stream entry into one fixed width 18 byte field (see schemas/wire.py), the workers then always use the binary COPY buffer
+
+    # Archive settings:
+    ARCHIVE: bool = False # worker also writes every batch to columnar files in ARCHIVE_DIR, entries are acknowledged once in both
+    ARCHIVE_DIR: str = 'archive'
+    ARCHIVE_FORMAT: Literal['parquet', 'arrow'] = 'parquet' # Parquet (zstd) or Arrow IPC files
+    ARCHIVE_ROW_GROUP: int = 100000 # rows gathered before they are written out as one row group
+    ARCHIVE_MAX_ROWS: int = 1000000 # rows per file before it is committed and a new one started
+    ARCHIVE_MAX_AGE: float = 30 # time in seconds before a file is committed regardless of size, keep below CLAIM_MIN_IDLE
+
+    # API settings:
+    MAX_BATCH_ITEMS: int = 10000 # maximum number of readings accepted in one /readings/fast/batch request
+    MAX_BATCH_BYTES: int = 2097152 # maximum /readings/fast/batch body size in bytes (2 MiB), larger bodies get 413 before they are parsed
+    ADMISSION_CONTROL: bool = False # reject /readings/fast writes with 429/503 once the stream backlog or memory budget is exceeded
+    ADMISSION_MAX_BACKLOG: int = 500000 # entries per stream not yet acknowledged by the workers before writes get 429
+    ADMISSION_MAX_STREAM_LENGTH: int = 2000000 # entries per stream before writes get 503
+    ADMISSION_MAX_MEMORY: int = 0 # bytes of Redis used_memory before writes get 503, 0 disables the memory check
+    ADMISSION_REFRESH: float = 0.25 # time in seconds between refreshes of the cached stream state
+    ADMISSION_RETRY_AFTER: int = 1 # Retry-After header in seconds sent with rejected writes
+    LATEST_CACHE: bool = False # worker keeps each device's newest reading in LATEST_HASH, serves /readings/{id}/latest without the database
+    LATEST_HASH: str = 'latest_readings'
+    LATEST_CACHE_SIZE: int = 100000 # devices kept in each API process' in-memory LRU
+    LATEST_CACHE_TTL: float = 0.5 # seconds an API process may serve a cached reading before asking Redis again
+    IDEMPOTENCY: bool = False # /readings/fast answers 'duplicate' instead of writing a reading it saw in the last IDEMPOTENCY_TTL seconds
+    IDEMPOTENCY_TTL: int = 300 # time in seconds a dedup key is remembered, bounds Redis memory to about request rate * TTL keys
+    GROUP_COMMIT_MAX_WAIT: float = 0.005 # time in seconds /readings/durable waits for more requests to join a commit
+    GROUP_COMMIT_MAX_BATCH: int = 1000 # waiting /readings/durable requests that trigger an immediate commit
+    EXPORT_MAX_CONCURRENT: int = 2 # /readings/export requests allowed at once, each holds a pooled connection for the whole export
+    EXPORT_QUEUE_CHUNKS: int = 16 # COPY output chunks buffered per export before the query waits for the client
+    LIVE_TAIL_QUEUE: int = 32 # events buffered per /readings/live client, a slower client loses its oldest events
+    LIVE_TAIL_MAX_CLIENTS: int = 1000 # /readings/live clients per API process before new ones get 503
+    LIVE_TAIL_KEEPALIVE: float = 15 # time in seconds without events before a /readings/live client is sent a keepalive comment
     # -----------------------------------------------------------------
     model_config = SettingsConfigDict(
         env_file='.env',
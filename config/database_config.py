@@ -1,5 +1,5 @@
 import asyncpg
-from asyncpg import Pool
+from asyncpg import Pool, Connection
 
 async def create_async_db_pool(
         USER: str, 
@@ -38,4 +38,41 @@ async def clear_db(DATABASE_PASS: str, CLEAR_DB: bool = False, CLEAR_DB2: bool =
         async with conn.transaction():
             await conn.execute('''
                     TRUNCATE TABLE readings2 RESTART IDENTITY
-                ''') # clears the readings2 database and restarts the id column at 1
\ No newline at end of file
+                ''') # clears the readings2 database and restarts the id column at 1
+
+async def create_staging_table(conn: Connection, table: str) -> str:
+    """
+    Creates a temporary staging table shaped like TABLE for this connection, if it does not exist yet, and returns its name
+    Temporary tables skip the WAL and live as long as the (pooled) connection, ON COMMIT DELETE ROWS empties it after every transaction
+    INCLUDING IDENTITY lets rows be COPYed without an id into a staging table of readings2, TABLE still generates the real ids
+    """
+    staging = f'{table}_staging'
+    await conn.execute(f'''
+        CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS INCLUDING IDENTITY) ON COMMIT DELETE ROWS
+    ''')
+    return staging
+
+async def insert_from_staging(conn: Connection, table: str, staging: str, columns: tuple[str, ...]) -> int:
+    """
+    Moves the rows COPYed into STAGING into TABLE, skipping rows whose primary key already exists (or repeats within the batch)
+    Must run in the same transaction as the COPY, returns the number of rows kept
+    """
+    column_list = ', '.join(columns)
+    status = await conn.execute(f'''
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list} FROM {staging}
+        ON CONFLICT DO NOTHING
+    ''') # status is 'INSERT 0 <rows inserted>'
+    return int(status.split()[-1])
+
+async def insert_from_staging_returning(conn: Connection, table: str, staging: str, columns: tuple[str, ...]) -> list:
+    """
+    insert_from_staging that also returns the rows it kept (COLUMNS of each), to tell callers which of theirs were duplicates
+    """
+    column_list = ', '.join(columns)
+    return await conn.fetch(f'''
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list} FROM {staging}
+        ON CONFLICT DO NOTHING
+        RETURNING {column_list}
+    ''')
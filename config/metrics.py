@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import AsyncIterator, Awaitable, Callable
+
+from asyncpg import Pool, Connection
+
+logger = logging.getLogger('iot-firehose-logger')
+
+# Every process (API or worker) is single threaded asyncio, so metric updates are plain integer and float arithmetic:
+# no locks, no atomics, roughly the cost of a dict lookup. Each process exposes its own values (Prometheus text format)
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # seconds
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000) # rows
+
+registry: list = [] # every metric, in the order they are exposed
+collectors: list[Callable[[], Awaitable[None]]] = [] # refresh gauges that are cheaper to read at scrape time than to keep current
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    """Renders a label set, e.g. {endpoint="/readings/fast",status="200"}"""
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+class Counter:
+    """Monotonic count per label set"""
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+        registry.append(self)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{format_labels(self.labels, labels)} {value}' for labels, value in self.values.items())
+        return lines
+
+class Gauge:
+    """Last set value per label set"""
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+        registry.append(self)
+
+    def set(self, value: float, *labels) -> None:
+        self.values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        lines.extend(f'{self.name}{format_labels(self.labels, labels)} {value}' for labels, value in self.values.items())
+        return lines
+
+class Histogram:
+    """
+    Distribution over fixed BUCKETS (upper bounds), observe() is one bisect and three additions
+    Bucket counts are stored per bucket and only made cumulative when rendered
+    """
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...], labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self.series: dict[tuple, list] = {} # labels -> [per bucket counts (last one is +Inf), sum, count]
+        registry.append(self)
+
+    def observe(self, value: float, *labels) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1 # first bucket whose bound is >= value
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{format_labels((*self.labels, "le"), (*labels, bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {count}')
+        return lines
+
+# API
+http_requests = Counter('iot_http_requests_total', 'HTTP requests by method, route and status code', ('method', 'endpoint', 'status'))
+xadd_seconds = Histogram('iot_xadd_seconds', 'Time to write entries to the Redis stream, per request or pipelined batch', LATENCY_BUCKETS, ('endpoint',))
+# worker
+flush_batch_size = Histogram('iot_flush_batch_size', 'Entries per flushed batch', SIZE_BUCKETS)
+flush_seconds = Histogram('iot_flush_seconds', 'Time to flush one batch, from COPY to XACK', LATENCY_BUCKETS)
+copy_seconds = Histogram('iot_copy_seconds', 'Time of the COPY transaction of one batch', LATENCY_BUCKETS, ('table',))
+xack_seconds = Histogram('iot_xack_seconds', 'Time to acknowledge a flushed batch', LATENCY_BUCKETS)
+flush_target_batch = Gauge('iot_flush_target_batch', 'Batch size the flush controller currently flushes at')
+flush_max_wait_seconds = Gauge('iot_flush_max_wait_seconds', 'Longest the flush controller currently lets the oldest buffered entry wait')
+arrival_rate = Gauge('iot_arrival_rate', 'Entries read from the stream per second, as measured by the flush controller')
+consumer_lag = Gauge('iot_consumer_lag', 'Stream entries not yet delivered to the consumer group', ('stream',))
+dead_lettered = Counter('iot_dead_lettered_total', 'Entries moved to DEAD_LETTER_STREAM after MAX_DELIVERIES deliveries', ('stream',))
+pending_entries = Gauge('iot_pending_entries', 'Entries delivered to the consumer group but not acknowledged (PEL size)', ('stream',))
+# both
+pool_acquire_seconds = Histogram('iot_pool_acquire_seconds', 'Time waiting for an asyncpg pool connection', LATENCY_BUCKETS, ('component',))
+
+async def render() -> str:
+    """Refreshes the scrape time gauges, then renders every metric in Prometheus text format"""
+    for collect in collectors:
+        try:
+            await collect()
+        except Exception as e: # a failed refresh keeps the last values
+            logger.error(f'Metrics collector failed: {e}')
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+@asynccontextmanager
+async def timed_acquire(pool: Pool, component: str) -> AsyncIterator[Connection]:
+    """pool.acquire() that records how long the caller waited for the connection"""
+    start = perf_counter()
+    async with pool.acquire() as conn:
+        pool_acquire_seconds.observe(perf_counter() - start, component)
+        yield conn
+
+class RequestMetrics:
+    """
+    Pure ASGI middleware counting requests by route template and status code
+    Unlike BaseHTTPMiddleware it adds no task or body copy per request, just a wrapped send
+    """
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500 # an exception escaping the app is answered with 500
+
+        async def send_status(message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get('route') # set by the router once matched, its template keeps /readings/{id}/latest to one series
+            http_requests.inc(scope['method'], route.path if route is not None else 'unmatched', status)
+
+async def serve_metrics(host: str, port: int) -> asyncio.Server:
+    """
+    Minimal HTTP server answering GET /metrics on HOST:PORT, for processes without a web framework (the workers)
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''): # skip the headers
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1].split(b'?')[0] == b'/metrics':
+                body = (await render()).encode()
+                status = b'200 OK'
+            else:
+                body = b'Not found\n'
+                status = b'404 Not Found'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: '
+                         + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+
+from asyncpg import Pool, Connection
+
+logger = logging.getLogger('iot-firehose-logger')
+
+PARTITIONED_TABLES = ('readings', 'readings2')
+INTERVALS = {'day': timedelta(days=1), 'hour': timedelta(hours=1)}
+NAME_FORMATS = {'day': '%Y%m%d', 'hour': '%Y%m%d%H'} # partition names are <table>_p<start>, e.g. readings_p20250117
+MAINTENANCE_LOCK = 8_157_346_001 # advisory lock key so only one worker process runs maintenance at a time
+
+# Both tables are range partitioned on timestamp. The primary key of a partitioned table must include the partition key,
+# so readings is unique on (id, timestamp) rather than id alone. readings2 uses bigserial since identity columns
+# on partitioned tables need PostgreSQL 17
+TABLE_DEFINITIONS = {
+    'readings': '''
+        CREATE TABLE IF NOT EXISTS readings (
+            id bigint NOT NULL,
+            reading smallint NOT NULL,
+            timestamp timestamptz NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    ''',
+    'readings2': '''
+        CREATE TABLE IF NOT EXISTS readings2 (
+            id bigserial,
+            reading smallint NOT NULL,
+            timestamp timestamptz NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    ''',
+}
+
+def partition_start(moment: datetime, interval: str) -> datetime:
+    """
+    Start (UTC) of the partition MOMENT falls in
+    """
+    moment = moment.astimezone(timezone.utc)
+    if interval == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def partition_name(table: str, start: datetime, interval: str) -> str:
+    """Name of TABLE's partition starting at START"""
+    return f'{table}_p{start.strftime(NAME_FORMATS[interval])}'
+
+async def create_partitioned_table(conn: Connection, table: str) -> bool:
+    """
+    Creates TABLE as a range partitioned table with a default partition and a BRIN index on timestamp, if it does not exist
+    Returns False (and leaves the table alone) if TABLE already exists as a plain table, it has to be migrated by hand
+    """
+    kind = await conn.fetchval('SELECT relkind FROM pg_class WHERE oid = to_regclass($1)', table)
+    if kind not in (None, 'p'): # 'p' partitioned table, 'r' plain table
+        logger.warning(f'{table} exists and is not partitioned, skipping partition management for it')
+        return False
+
+    await conn.execute(TABLE_DEFINITIONS[table])
+    await conn.execute(f'CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT') # catches rows outside every partition instead of failing the COPY
+    await conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_timestamp_brin ON {table} USING brin (timestamp)') # tiny index that suits append only, time ordered data
+    return True
+
+async def create_upcoming_partitions(conn: Connection, table: str, interval: str, premake: int) -> None:
+    """
+    Creates the current partition and the next PREMAKE ones, so the COPY never waits on DDL
+    """
+    step = INTERVALS[interval]
+    start = partition_start(datetime.now(timezone.utc), interval)
+    for i in range(premake + 1):
+        lower = start + i * step
+        name = partition_name(table, lower, interval)
+        try:
+            async with conn.transaction(): # savepoint, so one failed partition doesn't abort the whole maintenance transaction
+                await conn.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+                    FOR VALUES FROM ('{lower.isoformat()}') TO ('{(lower + step).isoformat()}')
+                ''')
+        except Exception as e: # e.g. the default partition already holds rows for this range
+            logger.error(f'Could not create partition {name}: {e}')
+
+async def drop_expired_partitions(conn: Connection, table: str, interval: str, retention: int) -> None:
+    """
+    Detaches and drops partitions whose upper bound is more than RETENTION intervals ago
+    Dropping a whole partition is instant compared to DELETE and leaves nothing for VACUUM
+    Expiry comes from each partition's actual bound, not its name, so partitions made with the other PARTITION_INTERVAL
+    expire when their own range does. Only partitions named by create_upcoming_partitions are considered,
+    the default partition is never dropped
+    """
+    cutoff = partition_start(datetime.now(timezone.utc), interval) - retention * INTERVALS[interval]
+    partitions = await conn.fetch(r'''
+        SELECT child.relname,
+               substring(pg_get_expr(child.relpartbound, child.oid) FROM 'TO \(''([^'']+)''\)')::timestamptz AS upper
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = $1
+    ''', table) # upper is NULL for the default partition and for MAXVALUE bounds
+    ours = re.compile(rf'{re.escape(table)}_p\d{{8}}(\d{{2}})?') # day or hour names, see NAME_FORMATS
+    for name, upper in partitions:
+        if upper is None or not ours.fullmatch(name):
+            continue
+        if upper <= cutoff:
+            await conn.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+            await conn.execute(f'DROP TABLE {name}')
+            logger.info(f'Dropped expired partition {name}')
+
+async def maintain_partitions(pool: Pool, interval: str, premake: int, retention: int) -> None:
+    """
+    One maintenance pass over readings and readings2: create missing tables, premake partitions, drop expired ones
+    Guarded by an advisory lock so concurrent worker processes don't race on the same DDL
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if not await conn.fetchval('SELECT pg_try_advisory_xact_lock($1)', MAINTENANCE_LOCK):
+                return # another worker is already on it
+            for table in PARTITIONED_TABLES:
+                if not await create_partitioned_table(conn, table):
+                    continue
+                await create_upcoming_partitions(conn, table, interval, premake)
+                if retention > 0:
+                    await drop_expired_partitions(conn, table, interval, retention)
+
+async def partition_maintenance(pool: Pool, interval: str, premake: int, retention: int, every: float) -> None:
+    """
+    Runs maintain_partitions every EVERY seconds until cancelled, errors are logged and retried on the next pass
+    The first pass is expected to have run already, before the worker's first COPY
+    """
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await maintain_partitions(pool, interval, premake, retention)
+        except Exception as e:
+            logger.error(f'Partition maintenance failed: {e}')
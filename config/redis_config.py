@@ -4,4 +4,10 @@ pool = redis.ConnectionPool.from_url('redis://localhost:6379/0',
                                     decode_responses=True,
                                     max_connections = 200) # max_connections 200 to help handle high number of redis requests
 
-redis_client = redis.Redis(connection_pool=pool) # create common redis client to reuse connections
\ No newline at end of file
+redis_client = redis.Redis(connection_pool=pool) # create common redis client to reuse connections
+
+binary_pool = redis.ConnectionPool.from_url('redis://localhost:6379/0',
+                                    decode_responses=False,
+                                    max_connections = 200) # binary stream entries (WIRE_FORMAT=binary) must be read back as raw bytes
+
+redis_binary_client = redis.Redis(connection_pool=binary_pool)
\ No newline at end of file
@@ -0,0 +1,29 @@
+from config.config import settings
+
+def shard_stream(shard: int) -> str:
+    """
+    Stream key of one shard, e.g. db_buffer:3
+    """
+    return f'{settings.STREAM_NAME}:{shard}'
+
+def shard_streams(shard_count: int) -> list[str]:
+    """
+    Every stream key of a layout with SHARD_COUNT shards
+    """
+    return [shard_stream(shard) for shard in range(shard_count)]
+
+def stream_layout(shard_count: int) -> list[str]:
+    """
+    Stream keys producers write to with SHARD_COUNT shards
+    """
+    return [settings.STREAM_NAME] if shard_count <= 1 else shard_streams(shard_count)
+
+def stream_for(id: int) -> str:
+    """
+    Stream key a reading is written to
+    Unsharded (SHARD_COUNT 1) everything goes to STREAM_NAME, otherwise the device id picks the shard
+    so all readings of one device land in the same stream, in order
+    """
+    if settings.SHARD_COUNT <= 1:
+        return settings.STREAM_NAME
+    return f'{settings.STREAM_NAME}:{id % settings.SHARD_COUNT}' # python's % is never negative, so negative ids are fine too
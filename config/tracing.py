@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import signal
+from array import array
+from random import random
+from time import time_ns
+
+from config.config import settings
+
+logger = logging.getLogger('iot-firehose-logger')
+
+# Event kinds and the debug log line each one is dumped as, the same lines the VERBOSE logs write,
+# so a dump can be fed to the iot-firehose-visualizer as is
+(ACQUIRE, EXECUTE, EXECUTED, COMMIT, RELEASE, CLOSE, DONE,
+ READ, READ_DONE, BATCH, COPY, ACK, BATCH_DONE) = range(13)
+MESSAGES = (
+    'Request ID {} about to acquire connection at time {}',
+    'Request ID {} beginning execution at time {}',
+    'Request ID {} finished execution at time {}',
+    'Request ID {} finalized transaction at time {}',
+    'Request ID {} releasing connection at time {}',
+    'Request ID {} closing connection at time {}',
+    'Request ID {} successfully logged at time {}',
+    'Redis group reading up to {} entries at time {}',
+    'Redis group read {} entries at time {}',
+    'Redis group processing {} requests at time {}',
+    'Redis group making database copy with {} requests at time {}',
+    'Redis group acknowledging completing {} requests at time {}',
+    'Redis group completed processing {} requests at time {}',
+)
+LINE_PREFIX = 'DEBUG:iot-firehose-logger:' # logging.basicConfig's default format
+
+class Tracer:
+    """
+    Sampled execution tracing into a preallocated ring buffer of CAPACITY events
+    An event is three integers (kind, request ID or batch size, time_ns) written into a flat array: no allocation,
+    no string formatting and no I/O when recording. Lines are only formatted when the buffer is dumped
+    Callers ask sample() once per request or batch and record that unit's events only if it was picked, so traces
+    stay complete per request. Events overwritten before a dump are lost, dump often enough for the sampled rate
+    """
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.events = array('q', bytes(3 * 8 * capacity))
+        self.recorded: int = 0 # events recorded since startup, the next one goes to slot recorded % capacity
+        self.dumped: int = 0 # events recorded before this one have been dumped (or overwritten)
+
+    def sample(self) -> bool:
+        """True for a RATE fraction of calls"""
+        return self.rate > 0 and random() < self.rate
+
+    def record(self, kind: int, value: int) -> None:
+        """Records an event of KIND now, VALUE is the request ID or the number of entries"""
+        i = self.recorded % self.capacity * 3
+        events = self.events
+        events[i] = kind
+        events[i + 1] = value
+        events[i + 2] = time_ns()
+        self.recorded += 1
+
+    def take(self) -> list[tuple[int, int, int]]:
+        """The events recorded since the last take that are still in the buffer, oldest first"""
+        start = max(self.dumped, self.recorded - self.capacity)
+        events = self.events
+        taken = []
+        for n in range(start, self.recorded):
+            i = n % self.capacity * 3
+            taken.append((events[i], events[i + 1], events[i + 2]))
+        if start > self.dumped:
+            logger.warning(f'Trace buffer overwrote {start - self.dumped} events before they were dumped')
+        self.dumped = self.recorded
+        return taken
+
+    async def dump(self, path: str) -> None:
+        """
+        Appends the new events to PATH as visualizer log lines, the file is written in a thread
+        """
+        events = self.take()
+        if not events:
+            return
+        text = ''.join(LINE_PREFIX + MESSAGES[kind].format(value, time) + '\n' for kind, value, time in events)
+
+        def write() -> None:
+            with open(path, 'a', encoding='utf-8') as file:
+                file.write(text) # one write, so dumps from several processes appending to PATH don't interleave lines
+
+        await asyncio.to_thread(write)
+
+    async def dump_periodically(self, path: str, every: float) -> None:
+        """Dumps every EVERY seconds until cancelled"""
+        while True:
+            await asyncio.sleep(every)
+            try:
+                await self.dump(path)
+            except Exception as e:
+                logger.error(f'Trace dump failed: {e}')
+
+tracer = Tracer(settings.TRACE_SAMPLE_RATE, settings.TRACE_CAPACITY if settings.TRACE_SAMPLE_RATE > 0 else 1)
+
+def start_tracing() -> asyncio.Task | None:
+    """
+    Dumps the trace buffer to TRACE_FILE on SIGUSR1 (where the platform has it) and every TRACE_DUMP_INTERVAL seconds
+    Must be called from inside the running event loop, returns the periodic dump task if there is one
+    """
+    if settings.TRACE_SAMPLE_RATE <= 0:
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, lambda: loop.create_task(tracer.dump(settings.TRACE_FILE))) # type: ignore
+    except (AttributeError, NotImplementedError): # no SIGUSR1 or no loop signal handlers (Windows), periodic dumps only
+        pass
+    if settings.TRACE_DUMP_INTERVAL > 0:
+        return loop.create_task(tracer.dump_periodically(settings.TRACE_FILE, settings.TRACE_DUMP_INTERVAL))
+    return None
+
+async def stop_tracing(task: asyncio.Task | None) -> None:
+    """Stops the periodic dumps and writes out whatever is left in the buffer"""
+    if task is not None:
+        task.cancel()
+    if settings.TRACE_SAMPLE_RATE > 0:
+        await tracer.dump(settings.TRACE_FILE)
@@ -1,17 +1,34 @@
+import asyncio
 import traceback
 import logging
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
-from time import time_ns
+from typing import AsyncGenerator, Literal
+from time import time_ns, perf_counter
+from datetime import datetime, timezone
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
+from pydantic import ValidationError
 import asyncpg
+import orjson
 
-from schemas.db_model import DatabasePayload, ResponseModel
-from config.redis_config import redis_client
+from schemas.db_model import DatabasePayload, ResponseModel, BatchResponseModel, LatestReading, Rollup, BatchTooLarge, parse_batch, parse_lean
+from schemas.wire import BINARY_FIELD, WIRE_STRUCT, pack_reading, to_epoch_us
+from config.redis_config import redis_client, redis_binary_client
 from config.database_config import create_async_db_pool, clear_db
 from config.log import setup_logger
 from config.config import settings
+from config.sharding import stream_for, stream_layout
+from config import metrics, tracing
+from config.tracing import tracer
+from services.coalescer import XaddCoalescer
+from services.admission import AdmissionController
+from services.latest_cache import LatestCache
+from services.export import export_readings, MEDIA_TYPES
+from services.idempotency import xadd_once
+from services.group_commit import GroupCommitter, DuplicateReading
+from services.live_tail import LiveTail
 
 logger: logging.Logger = setup_logger(settings.VERBOSE, settings.CLEAR_LOG)
 
@@ -22,34 +39,258 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     If CLEAR_LOG mode, clears the debug log (default False)
     If CLEAR_DB mode, clear the readings table (default False)
     If CLEAR_DB2 mode, clear the readings2 table (default False)
-    Closes connection pool and redis client on shutdown
+    If XADD_COALESCE mode, /readings/fast goes through an XaddCoalescer instead of the redis client (default False)
+    If ADMISSION_CONTROL mode, starts refreshing the cached stream backlog (default False)
+    Creates the latest value cache, backed by the Redis hash the worker fills in LATEST_CACHE mode and by the database otherwise
+    Starts the group committer behind /readings/durable
+    Creates the live tail behind /readings/live, its stream reader only runs while clients are connected
+    With TRACE_SAMPLE_RATE > 0, dumps sampled traces on SIGUSR1, every TRACE_DUMP_INTERVAL seconds and on shutdown
+    Flushes the coalescer, closes connection pool and redis client on shutdown
     """
     app.state.pool = await create_async_db_pool(settings.USER, settings.DATABASE, settings.HOST, settings.PORT, 
                                                 settings.DATABASE_PASS, settings.MIN_SIZE, settings.MAX_SIZE) # type: ignore
     await clear_db(settings.DATABASE_PASS, settings.CLEAR_DB, settings.CLEAR_DB2)
+    if settings.XADD_COALESCE:
+        app.state.producer = XaddCoalescer(redis_client, settings.COALESCE_WINDOW, settings.COALESCE_MAX_BATCH)
+        app.state.producer.start()
+    else:
+        app.state.producer = redis_client # both expose xadd(name, fields)
+    if settings.ADMISSION_CONTROL:
+        app.state.admission = AdmissionController(redis_client, stream_layout(settings.SHARD_COUNT), settings.CONSUMER_GROUP,
+                                                  settings.ADMISSION_MAX_BACKLOG, settings.ADMISSION_MAX_STREAM_LENGTH,
+                                                  settings.ADMISSION_MAX_MEMORY, settings.ADMISSION_REFRESH)
+        app.state.admission.start()
+    app.state.tracing = tracing.start_tracing()
+    app.state.latest = LatestCache(redis_client, app.state.pool, settings.LATEST_HASH, settings.LATEST_CACHE_SIZE, settings.LATEST_CACHE_TTL,
+                                   settings.LATEST_CACHE)
+    app.state.committer = GroupCommitter(app.state.pool, settings.GROUP_COMMIT_MAX_WAIT, settings.GROUP_COMMIT_MAX_BATCH,
+                                         app.state.latest.written)
+    app.state.committer.start()
+    app.state.exports = asyncio.Semaphore(settings.EXPORT_MAX_CONCURRENT)
+    binary = settings.WIRE_FORMAT == 'binary'
+    app.state.live_tail = LiveTail(redis_binary_client if binary else redis_client, stream_layout(settings.SHARD_COUNT), binary,
+                                   settings.LIVE_TAIL_QUEUE, settings.LIVE_TAIL_KEEPALIVE)
     yield
+    await app.state.live_tail.stop()
+    await app.state.committer.stop() # commits what is still queued while the pool is open
+    if settings.ADMISSION_CONTROL:
+        await app.state.admission.stop()
+    if settings.XADD_COALESCE:
+        await app.state.producer.stop()
     await app.state.pool.close()
     await redis_client.close()
+    await tracing.stop_tracing(app.state.tracing)
 
 app = FastAPI(lifespan=lifespan)
+if settings.METRICS:
+    app.add_middleware(metrics.RequestMetrics)
 
-@app.post("/readings/fast")
-async def post_reading(reading: DatabasePayload) -> ResponseModel:
+def stream_fields(reading: DatabasePayload) -> dict:
     """
-    Producer that xadds client request to Redis stream, return buffered
+    Builds the Redis stream entry for a reading
+    In WIRE_FORMAT binary mode the entry is a single packed field instead of three strings
     """
-    payload = {
+    if settings.WIRE_FORMAT == 'binary':
+        return {BINARY_FIELD: pack_reading(reading.id, reading.reading, reading.timestamp)} # type: ignore
+    return {
         'id': reading.id,
         'reading': reading.reading,
         'timestamp': reading.timestamp.isoformat() # type: ignore
     } # using a dictionary payload instead of json dumping the pydantic model results in slightly less CPU usage
-    
-    await redis_client.xadd(settings.STREAM_NAME, payload) # type: ignore
+
+LEAN_RESPONSE = orjson.dumps({'status': 'buffered', 'message': 'Item added to Redis stream'}) # serialized once, the same for every request
+LEAN_DUPLICATE_RESPONSE = orjson.dumps({'status': 'duplicate', 'message': 'Item already added to Redis stream'}) # IDEMPOTENCY
+
+def lean_fields(id: int, reading: int) -> dict:
+    """
+    stream_fields for a reading that was checked inline and takes the default timestamp, without a DatabasePayload
+    """
+    if settings.WIRE_FORMAT == 'binary':
+        return {BINARY_FIELD: WIRE_STRUCT.pack(id, reading, time_ns() // 1000)} # unix microseconds, no datetime needed
+    return {'id': id, 'reading': reading, 'timestamp': datetime.now(timezone.utc).isoformat()}
+
+def check_admission(stream: str) -> None:
+    """
+    Rejects the request with 429/503 and a Retry-After header if STREAM is over its backlog or memory budget
+    Only reads the admission controller's cached state, no Redis call
+    """
+    status = app.state.admission.admit(stream)
+    if status is not None:
+        raise HTTPException(
+            status_code=status,
+            detail='Workers are behind, retry later' if status == 429 else 'Stream is over its memory budget, retry later',
+            headers={'Retry-After': str(settings.ADMISSION_RETRY_AFTER)}
+        )
+
+def dedup_key(request: Request, id: int, timestamp: datetime | None) -> str:
+    """
+    Key identifying a reading for IDEMPOTENCY: the client's Idempotency-Key header (scoped to the device) if sent,
+    otherwise whatever readings is unique on, so exactly the retries that would fail a COPY batch are dropped:
+    id, or (id, timestamp) with PARTITIONING
+    TIMESTAMP is None for a lean reading that takes the default timestamp, which is new for every request
+    """
+    key = request.headers.get('Idempotency-Key')
+    if key is not None:
+        return f'idempotency:{id}:{key}'
+    if settings.PARTITIONING:
+        return f'idempotency:{id}:{to_epoch_us(timestamp) if timestamp is not None else time_ns() // 1000}'
+    return f'idempotency:{id}'
+
+@app.post("/readings/fast")
+async def post_reading(reading: DatabasePayload, request: Request) -> ResponseModel:
+    """
+    Producer that xadds client request to Redis stream, return buffered
+    With SHARD_COUNT > 1 the stream is picked by device id
+    With ADMISSION_CONTROL the request is rejected while the stream is over budget
+    With XADD_COALESCE the request waits for its entry to be written as part of a coalesced batch
+    With IDEMPOTENCY a reading seen in the last IDEMPOTENCY_TTL seconds is answered duplicate and not written,
+    the check and the XADD are one script call so it costs no extra round trip
+    """
+    stream = stream_for(reading.id)
+    if settings.ADMISSION_CONTROL:
+        check_admission(stream)
+    start = perf_counter()
+    if settings.IDEMPOTENCY:
+        key = dedup_key(request, reading.id, reading.timestamp)
+        if settings.XADD_COALESCE:
+            entry = await app.state.producer.xadd_once(key, settings.IDEMPOTENCY_TTL, stream, stream_fields(reading))
+        else:
+            entry = await xadd_once(redis_client, key, settings.IDEMPOTENCY_TTL, stream, stream_fields(reading))
+        metrics.xadd_seconds.observe(perf_counter() - start, '/readings/fast')
+        if entry is None:
+            return ResponseModel(
+                status='duplicate',
+                message='Item already added to Redis stream',
+            )
+    else:
+        await app.state.producer.xadd(stream, stream_fields(reading)) # type: ignore
+        metrics.xadd_seconds.observe(perf_counter() - start, '/readings/fast')
     return ResponseModel(
         status='buffered',
         message='Item added to Redis stream',
     )
 
+@app.post("/readings/fast/lean")
+async def post_reading_lean(request: Request) -> Response:
+    """
+    /readings/fast without the per request model overhead: the common payload is validated without a model (see parse_lean)
+    and the response body is precomputed, so neither a DatabasePayload nor a ResponseModel is built and FastAPI serializes nothing
+    Anything else is validated by DatabasePayload exactly like /readings/fast, so both endpoints accept and reject the same payloads
+    With IDEMPOTENCY, duplicates are answered duplicate and not written, with the same dedup key as /readings/fast
+    The response has no timestamp field
+    """
+    try:
+        parsed = parse_lean(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise RequestValidationError([{'type': 'json_invalid', 'loc': ('body', e.pos), 'msg': 'JSON decode error',
+                                       'input': {}, 'ctx': {'error': e.msg}}])
+    except ValidationError as e:
+        raise RequestValidationError([{**error, 'loc': ('body', *error['loc'])} for error in e.errors(include_url=False)])
+
+    if isinstance(parsed, tuple):
+        id, reading = parsed
+        timestamp = None
+        fields = lean_fields(id, reading)
+    else:
+        id, timestamp = parsed.id, parsed.timestamp
+        fields = stream_fields(parsed)
+
+    stream = stream_for(id)
+    if settings.ADMISSION_CONTROL:
+        check_admission(stream)
+    start = perf_counter()
+    if settings.IDEMPOTENCY:
+        key = dedup_key(request, id, timestamp)
+        if settings.XADD_COALESCE:
+            entry = await app.state.producer.xadd_once(key, settings.IDEMPOTENCY_TTL, stream, fields)
+        else:
+            entry = await xadd_once(redis_client, key, settings.IDEMPOTENCY_TTL, stream, fields)
+        metrics.xadd_seconds.observe(perf_counter() - start, '/readings/fast/lean')
+        if entry is None:
+            return Response(content=LEAN_DUPLICATE_RESPONSE, media_type='application/json')
+    else:
+        await app.state.producer.xadd(stream, fields) # type: ignore
+        metrics.xadd_seconds.observe(perf_counter() - start, '/readings/fast/lean')
+    return Response(content=LEAN_RESPONSE, media_type='application/json')
+
+async def read_body(request: Request, limit: int) -> bytes:
+    """
+    Reads the request body, answering 413 as soon as it is known to be over LIMIT bytes
+    A declared Content-Length is checked before anything is read, a chunked body as its chunks arrive
+    """
+    length = request.headers.get('content-length')
+    if length is not None and length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail=f'Body exceeds {limit} bytes')
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f'Body exceeds {limit} bytes')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+@app.post("/readings/fast/batch")
+async def post_readings_batch(request: Request) -> BatchResponseModel:
+    """
+    Producer that accepts a JSON array or NDJSON body of readings
+    Validates every reading in one pass, invalid items are reported back instead of rejecting the batch
+    Xadds all valid readings to the Redis stream in a single pipelined round trip, return buffered
+    Bodies over MAX_BATCH_BYTES or with more than MAX_BATCH_ITEMS items get 413 before any item is validated
+    """
+    try:
+        readings, errors = parse_batch(await read_body(request, settings.MAX_BATCH_BYTES), settings.MAX_BATCH_ITEMS)
+    except BatchTooLarge as e:
+        raise HTTPException(
+            status_code=413, # 413 content too large
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400, # 400 bad request
+            detail=str(e)
+        )
+
+    if settings.ADMISSION_CONTROL:
+        for stream in {stream_for(reading.id) for reading in readings}:
+            check_admission(stream)
+
+    if readings:
+        start = perf_counter()
+        async with redis_client.pipeline(transaction=False) as pipe: # no MULTI/EXEC needed, the pipeline only exists to save round trips
+            for reading in readings:
+                pipe.xadd(stream_for(reading.id), stream_fields(reading)) # type: ignore
+            await pipe.execute()
+        metrics.xadd_seconds.observe(perf_counter() - start, '/readings/fast/batch')
+
+    return BatchResponseModel(
+        status='buffered' if not errors else ('partial' if readings else 'failure'),
+        message=f'{len(readings)} items added to Redis stream',
+        accepted=len(readings),
+        rejected=len(errors),
+        errors=errors,
+    )
+
+@app.post("/readings/durable")
+async def post_reading_durable(reading: DatabasePayload) -> ResponseModel:
+    """
+    Group commit: the reading joins the next COPY of all concurrently waiting requests into readings, in one transaction
+    Returns success only once that transaction has committed, durable like /readings/slow/pooling but without
+    one transaction per request, and without Redis in the path
+    """
+    try:
+        await app.state.committer.submit(reading)
+    except DuplicateReading:
+        logger.error(f'Request ID {reading.id} failed to execute at time {time_ns()}: already exists')
+        raise HTTPException(
+            status_code=400, # 400 bad request
+            detail='Item already exists'
+        )
+    return ResponseModel(
+        status='success',
+        message='Item created',
+    )
+
 @app.post("/readings/slow/nonpooling")
 async def post_reading_slow_nonpooling(reading: DatabasePayload) -> ResponseModel:
     """
@@ -57,9 +298,13 @@ async def post_reading_slow_nonpooling(reading: DatabasePayload) -> ResponseMode
     Attempts to write readings directly to Postgres with asyncpg
     Closes connection
     Returns success
+    A TRACE_SAMPLE_RATE fraction of requests is traced (see config/tracing.py)
     """    
+    traced = tracer.sample()
     try: # attempt to make a connection to database
         logger.debug(f'Request ID {reading.id} about to acquire connection at time {time_ns()}')
+        if traced:
+            tracer.record(tracing.ACQUIRE, reading.id)
         conn = await asyncpg.connect(user=settings.USER, password=settings.DATABASE_PASS, 
                                 database=settings.DATABASE, host=settings.HOST, port=settings.PORT)
     except Exception as e:
@@ -72,11 +317,15 @@ async def post_reading_slow_nonpooling(reading: DatabasePayload) -> ResponseMode
     try:
         async with conn.transaction(): # important: use context manager to automatically commit on cleanup
             logger.debug(f'Request ID {reading.id} beginning execution at time {time_ns()}')
+            if traced:
+                tracer.record(tracing.EXECUTE, reading.id)
             await conn.execute('''
                 INSERT INTO readings (id, reading, timestamp)
                 VALUES ($1, $2, $3)
             ''', reading.id, reading.reading, reading.timestamp) # pass in the positional args for the sql query as separate args, not a list
             logger.debug(f'Request ID {reading.id} finished execution at time {time_ns()}')
+            if traced:
+                tracer.record(tracing.EXECUTED, reading.id)
     except asyncpg.UniqueViolationError:
         logger.error(f'Request ID {reading.id} failed to execute at time {time_ns()}: already exists')
         raise HTTPException(
@@ -89,9 +338,14 @@ async def post_reading_slow_nonpooling(reading: DatabasePayload) -> ResponseMode
         raise
     finally:
         logger.debug(f'Request ID {reading.id} closing connection at time {time_ns()}')
+        if traced:
+            tracer.record(tracing.CLOSE, reading.id)
         await conn.close() # important: remember to await conn.close() or it'll just return the coroutine object not run it
 
+    await app.state.latest.written([reading])
     logger.debug(f'Request ID {reading.id} successfully logged at time {time_ns()}')
+    if traced:
+        tracer.record(tracing.DONE, reading.id)
     return ResponseModel( # You need to create the ResponseModel in the coroutine so it doesn't reuse the same datetime object every time
         status='success',
         message='Item created',
@@ -104,19 +358,31 @@ async def post_reading_slow_pooling(reading: DatabasePayload) -> ResponseModel:
     Acquires asyncpg connection pool
     Attempts to write readings directly to Postgres with asyncpg
     Returns success
+    A TRACE_SAMPLE_RATE fraction of requests is traced (see config/tracing.py)
     """    
+    traced = tracer.sample()
     try:
         logger.debug(f'Request ID {reading.id} about to acquire connection at time {time_ns()}')
-        async with app.state.pool.acquire() as conn: # main difference: use connection pool to avoid having to re-establish database connections
+        if traced:
+            tracer.record(tracing.ACQUIRE, reading.id)
+        async with metrics.timed_acquire(app.state.pool, 'api') as conn: # main difference: use connection pool to avoid having to re-establish database connections
             async with conn.transaction(): # important: use context manager to automatically commit on cleanup
                 logger.debug(f'Request ID {reading.id} beginning execution at time {time_ns()}')
+                if traced:
+                    tracer.record(tracing.EXECUTE, reading.id)
                 await conn.execute('''
                     INSERT INTO readings (id, reading, timestamp)
                     VALUES ($1, $2, $3)
                 ''', reading.id, reading.reading, reading.timestamp) # pass in the positional args for the sql query as separate args, not a list
                 logger.debug(f'Request ID {reading.id} finished execution at time {time_ns()}')
+                if traced:
+                    tracer.record(tracing.EXECUTED, reading.id)
             logger.debug(f'Request ID {reading.id} finalized transaction at time {time_ns()}')
+            if traced:
+                tracer.record(tracing.COMMIT, reading.id)
         logger.debug(f'Request ID {reading.id} releasing connection at time {time_ns()}')
+        if traced:
+            tracer.record(tracing.RELEASE, reading.id)
     except asyncpg.UniqueViolationError:
         logger.error(f'Request ID {reading.id} failed to execute at time {time_ns()}: already exists')
         raise HTTPException(
@@ -128,12 +394,116 @@ async def post_reading_slow_pooling(reading: DatabasePayload) -> ResponseModel:
         logger.error(f'Request ID {reading.id} failed to execute at time {time_ns()}: {traceback.format_exc()}')
         raise
     
+    await app.state.latest.written([reading])
     logger.debug(f'Request ID {reading.id} successfully logged at time {time_ns()}')
+    if traced:
+        tracer.record(tracing.DONE, reading.id)
     return ResponseModel(
         status='success',
         message='Item created',
     )
 
+@app.get("/readings/export")
+async def export(start: datetime = Query(alias='from'), end: datetime = Query(alias='to'),
+                 format: Literal['csv', 'binary'] = 'csv') -> StreamingResponse:
+    """
+    Streams every readings2 row with timestamp in [from, to) straight from COPY ... TO STDOUT, as CSV with a header
+    or in PostgreSQL's binary COPY format
+    Memory stays bounded whatever the range, and a client disconnect cancels the query
+    At most EXPORT_MAX_CONCURRENT exports hold a pooled connection at once, further ones get 429
+    """
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if app.state.exports.locked():
+        raise HTTPException(status_code=429, detail='Too many exports in progress, retry later')
+
+    async def body() -> AsyncGenerator[bytes, None]:
+        async with app.state.exports: # taken once the response starts, so an export that never starts can't leak it
+            async for chunk in export_readings(app.state.pool, start, end, format, settings.EXPORT_QUEUE_CHUNKS):
+                yield chunk
+
+    return StreamingResponse(
+        body(),
+        media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="readings2.{"csv" if format == "csv" else "bin"}"'}
+    )
+
+@app.get("/readings/live")
+async def live_tail(ids: str | None = None) -> StreamingResponse:
+    """
+    Server-sent events of readings as they arrive on the stream, only devices in IDS (comma separated) if given
+    Each event holds a batch as JSON columns: id, reading and timestamp in microseconds since the unix epoch
+    Every client of this process shares one XREAD loop, a client too slow to keep up loses its oldest events
+    and is told how many with a 'dropped' event
+    """
+    device_ids = None
+    if ids:
+        try:
+            device_ids = [int(id) for id in ids.split(',') if id.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail='ids must be a comma separated list of integers')
+    if len(app.state.live_tail.subscribers) >= settings.LIVE_TAIL_MAX_CLIENTS:
+        raise HTTPException(status_code=503, detail='Too many live tail clients, retry later')
+
+    return StreamingResponse(
+        app.state.live_tail.stream(device_ids),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # no proxy buffering, events must go out as they come
+    )
+
+@app.get("/readings/latest")
+async def get_latest_readings(ids: str) -> list[LatestReading]:
+    """
+    Returns the latest reading of each device in IDS (comma separated), devices without readings are left out
+    Served from the latest value cache, only devices missing from both the in-process LRU and Redis (LATEST_CACHE) reach the database
+    """
+    try:
+        device_ids = [int(id) for id in ids.split(',') if id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail='ids must be a comma separated list of integers')
+    if len(device_ids) > settings.MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f'Request exceeds {settings.MAX_BATCH_ITEMS} ids')
+    return list((await app.state.latest.get_many(device_ids)).values())
+
+@app.get("/readings/{id}/latest")
+async def get_latest_reading(id: int) -> LatestReading:
+    """
+    Returns the latest reading of device ID from the latest value cache, 404 if it has none
+    """
+    reading = await app.state.latest.get(id)
+    if reading is None:
+        raise HTTPException(status_code=404, detail='No readings for this id')
+    return reading
+
+@app.get("/readings/rollups")
+async def get_rollups(id: int, start: datetime = Query(alias='from'), end: datetime = Query(alias='to')) -> list[Rollup]:
+    """
+    Returns device ID's per minute aggregates for minutes starting in [from, to), oldest first
+    Reads the small readings_1m table kept up to date by the worker (ROLLUP) instead of scanning raw readings
+    """
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    try:
+        async with app.state.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT id, bucket, count, sum, min, max, sum::float8 / count AS avg
+                FROM readings_1m
+                WHERE id = $1 AND bucket >= $2 AND bucket < $3
+                ORDER BY bucket
+            ''', id, start, end)
+    except asyncpg.UndefinedTableError:
+        raise HTTPException(status_code=404, detail='Rollups are not enabled, start the worker with ROLLUP=true')
+    return [Rollup(**row) for row in rows]
+
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    """
+    Prometheus metrics of this API process (each uvicorn worker process keeps its own)
+    """
+    if not settings.METRICS:
+        raise HTTPException(status_code=404, detail='Metrics are disabled')
+    return PlainTextResponse(await metrics.render(), media_type='text/plain; version=0.0.4')
+
 @app.get("/health")
 def health_check():
     """Dummy health check endpoint"""
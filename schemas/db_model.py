@@ -1,7 +1,9 @@
+import json
 from typing import Annotated, Optional
 from datetime import datetime, timezone
 
-from pydantic import BaseModel, Field, AfterValidator
+import orjson
+from pydantic import BaseModel, Field, AfterValidator, ValidationError
 
 def enforce_smallint(value: int) -> int:
     """
@@ -13,6 +15,17 @@ def enforce_smallint(value: int) -> int:
 
 SmallInt = Annotated[int, AfterValidator(enforce_smallint)] # used to enforce reading value is of type smallint to match postgres database
 
+def enforce_bigint(value: int) -> int:
+    """
+    Makes sure id is 64 bit signed integer to match PostgreSQL bigint data type
+    An id out of range would be buffered and then fail the worker's COPY for its whole batch
+    """
+    if not (-9223372036854775808 <= value <= 9223372036854775807):
+        raise ValueError('ID must be a 64 bit signed integer')
+    return value
+
+BigInt = Annotated[int, AfterValidator(enforce_bigint)] # used to enforce id value is of type bigint to match postgres database
+
 class DatabasePayload(BaseModel):
     """
     Defines the payload schema that is sent to API endpoints
@@ -20,15 +33,112 @@ class DatabasePayload(BaseModel):
     reading: 2 byte smallint
     timestamp: timestamp with time zone
     """
-    id: int
+    id: BigInt
     reading: SmallInt
     # Important: database posts should not specify timestamp except for debugging purposes
     timestamp: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc)) # use default factory to generate datetime at time of request
 
+def parse_lean(body: bytes) -> tuple[int, int] | DatabasePayload:
+    """
+    Validation behind /readings/fast/lean: the common payload ({"id": int, "reading": int} without a timestamp) is decoded
+    with orjson, range checked inline and returned as (id, reading) without building a model
+    Anything else (string or float numbers, an explicit timestamp, out of range or invalid values) is validated by
+    DatabasePayload exactly like /readings/fast
+    Raises orjson.JSONDecodeError if the body is not JSON, ValidationError if the payload is invalid
+    """
+    payload = orjson.loads(body)
+    if (type(payload) is dict and 'timestamp' not in payload
+            and type(id := payload.get('id')) is int and -9223372036854775808 <= id <= 9223372036854775807 # same bounds as enforce_bigint
+            and type(reading := payload.get('reading')) is int and -32768 <= reading <= 32767): # same bounds as enforce_smallint
+        return id, reading
+    return DatabasePayload.model_validate_json(body)
+
 class ResponseModel(BaseModel):
     """
     API endpoints return status, message, and timestamp after completion
     """
     status: str
     message: str
-    timestamp: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
\ No newline at end of file
+    timestamp: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class BatchItemError(BaseModel):
+    """
+    Describes a single rejected item in a batch request
+    index: position of the item in the submitted array or NDJSON body
+    """
+    index: int
+    detail: str
+
+class BatchResponseModel(ResponseModel):
+    """
+    Batch endpoints additionally report how many items were accepted and why any were rejected
+    """
+    accepted: int
+    rejected: int
+    errors: list[BatchItemError] = []
+
+class LatestReading(BaseModel):
+    """
+    The newest reading of one device, served from the latest value cache
+    """
+    id: int
+    reading: int
+    timestamp: datetime
+
+class Rollup(BaseModel):
+    """
+    One device's aggregates over one minute, maintained by the worker in readings_1m
+    """
+    id: int
+    bucket: datetime
+    count: int
+    sum: int
+    min: int
+    max: int
+    avg: float
+
+def format_validation_error(error: ValidationError) -> str:
+    """
+    Flattens a pydantic ValidationError into a single line, e.g. 'reading: Value error, Reading must be a 16 bit signed integer'
+    The raw error list can contain exception objects that are not JSON serializable
+    """
+    return '; '.join(f"{'.'.join(str(loc) for loc in err['loc']) or 'body'}: {err['msg']}" for err in error.errors())
+
+class BatchTooLarge(Exception):
+    """A batch body holding more items than the endpoint accepts, raised before any item is validated"""
+
+def parse_batch(body: bytes, max_items: int | None = None) -> tuple[list[DatabasePayload], list[BatchItemError]]:
+    """
+    Parses a batch body that is either a JSON array of payloads or NDJSON (one payload per line)
+    Validates every item in a single pass and collects per-item errors instead of rejecting the whole batch
+    Raises ValueError if the body is a malformed JSON array
+    Raises BatchTooLarge if it holds more than MAX_ITEMS items (array elements or non blank lines), before validating any
+    """
+    readings: list[DatabasePayload] = []
+    errors: list[BatchItemError] = []
+
+    if body.lstrip()[:1] == b'[': # JSON array
+        try:
+            items = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Malformed JSON array: {e}')
+        if max_items is not None and len(items) > max_items:
+            raise BatchTooLarge(f'Batch exceeds {max_items} items')
+        for index, item in enumerate(items):
+            try:
+                readings.append(DatabasePayload.model_validate(item))
+            except ValidationError as e:
+                errors.append(BatchItemError(index=index, detail=format_validation_error(e)))
+    else: # NDJSON, blank lines are skipped but still count towards the index so it matches the client's line numbers
+        lines = body.splitlines()
+        if max_items is not None and sum(1 for line in lines if line.strip()) > max_items:
+            raise BatchTooLarge(f'Batch exceeds {max_items} items')
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                readings.append(DatabasePayload.model_validate_json(line)) # model_validate_json parses in pydantic-core, skipping the intermediate dict
+            except ValidationError as e:
+                errors.append(BatchItemError(index=index, detail=format_validation_error(e)))
+
+    return readings, errors
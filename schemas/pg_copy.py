@@ -0,0 +1,50 @@
+import numpy as np
+
+# PostgreSQL binary COPY format: https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+# signature, 4 byte flags field and 4 byte header extension length, then one tuple per row and a -1 field count trailer
+HEADER = b'PGCOPY\n\xff\r\n\x00' + b'\x00\x00\x00\x00' + b'\x00\x00\x00\x00'
+TRAILER = b'\xff\xff'
+
+PG_EPOCH_OFFSET_US = 946684800 * 1_000_000 # timestamptz is sent as microseconds since 2000-01-01, wire timestamps are since 1970-01-01
+
+# Each tuple is a big endian int16 field count followed by (int32 length, value) per field, all fixed width here,
+# so a whole batch is one packed structured array that can be filled column by column
+ROW_DTYPE = np.dtype([
+    ('fields', '>i2'),
+    ('id_length', '>i4'), ('id', '>i8'), # bigint
+    ('reading_length', '>i4'), ('reading', '>i2'), # smallint
+    ('timestamp_length', '>i4'), ('timestamp', '>i8'), # timestamptz
+])
+ROW_DTYPE_NO_ID = np.dtype([
+    ('fields', '>i2'),
+    ('reading_length', '>i4'), ('reading', '>i2'),
+    ('timestamp_length', '>i4'), ('timestamp', '>i8'),
+]) # for tables with an identity column (readings2)
+
+def encode_copy(batch: np.ndarray, include_id: bool = True) -> bytearray:
+    """
+    Builds the binary COPY stream for a decoded batch (schemas.wire.WIRE_DTYPE) without creating a Python object per row
+    The buffer is preallocated at its exact final size and the rows are written through a numpy view of it
+    Send with conn.copy_to_table(table, source=buffer, columns=..., format='binary')
+    """
+    dtype = ROW_DTYPE if include_id else ROW_DTYPE_NO_ID
+    rows_size = len(batch) * dtype.itemsize
+    buffer = bytearray(len(HEADER) + rows_size + len(TRAILER))
+    view = memoryview(buffer)
+    view[:len(HEADER)] = HEADER
+    view[len(HEADER) + rows_size:] = TRAILER
+
+    rows = np.frombuffer(view[len(HEADER):len(HEADER) + rows_size], dtype=dtype) # writes to rows land directly in buffer
+    if include_id:
+        rows['fields'] = 3
+        rows['id_length'] = 8
+        rows['id'] = batch['id']
+    else:
+        rows['fields'] = 2
+    rows['reading_length'] = 2
+    rows['reading'] = batch['reading']
+    rows['timestamp_length'] = 8
+    rows['timestamp'] = batch['timestamp'] - PG_EPOCH_OFFSET_US
+    del rows # release the exported buffer so the bytearray can be resized/freed later
+    view.release()
+    return buffer
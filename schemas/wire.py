@@ -0,0 +1,157 @@
+import struct
+import logging
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Compact binary stream entry: id int64, reading int16, timestamp as microseconds since the unix epoch int64
+# Little endian and unaligned so every entry is exactly 18 bytes and a whole batch can be decoded with one np.frombuffer
+WIRE_DTYPE = np.dtype([('id', '<i8'), ('reading', '<i2'), ('timestamp', '<i8')])
+WIRE_STRUCT = struct.Struct('<qhq') # same layout as WIRE_DTYPE, struct is cheaper than numpy for packing a single entry
+BINARY_FIELD = 'b' # the only field of a binary stream entry
+BINARY_FIELD_BYTES = BINARY_FIELD.encode() # field name as returned by a client without decode_responses
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+logger = logging.getLogger('iot-firehose-logger')
+
+def to_epoch_us(timestamp: datetime) -> int:
+    """
+    Converts a datetime to integer microseconds since the unix epoch
+    Naive datetimes are treated as UTC
+    """
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (timestamp - EPOCH) // ONE_MICROSECOND
+
+def pack_reading(id: int, reading: int, timestamp: datetime) -> bytes:
+    """
+    Packs a reading into the fixed width binary entry format
+    """
+    return WIRE_STRUCT.pack(id, reading, to_epoch_us(timestamp))
+
+def decode_batch(blobs: list[bytes]) -> np.ndarray:
+    """
+    Decodes a whole batch of binary entries at once into a structured array with id, reading and timestamp columns
+    Raises ValueError if any entry is not WIRE_DTYPE.itemsize bytes long
+    """
+    buffer = b''.join(blobs)
+    if len(buffer) != len(blobs) * WIRE_DTYPE.itemsize:
+        raise ValueError(f'Binary stream entries must be {WIRE_DTYPE.itemsize} bytes each')
+    return np.frombuffer(buffer, dtype=WIRE_DTYPE)
+
+def to_records(batch: np.ndarray, include_id: bool = True) -> list[tuple]:
+    """
+    Converts a decoded batch into the list of tuples copy_records_to_table expects
+    Columns are converted to Python ints in bulk with tolist() so only the timezone aware datetime is built per record
+    include_id=False drops the id column for tables with an identity column (readings2)
+    """
+    timestamps = [EPOCH + timedelta(microseconds=us) for us in batch['timestamp'].tolist()] # asyncpg treats naive datetimes as local time, so these must be aware
+    if include_id:
+        return list(zip(batch['id'].tolist(), batch['reading'].tolist(), timestamps))
+    return list(zip(batch['reading'].tolist(), timestamps))
+
+def text_records(payloads: list[dict], include_id: bool = True) -> list[tuple]:
+    """
+    Converts text stream entries (WIRE_FORMAT text, read with decode_responses) into records for copy_records_to_table
+    A batch with a malformed entry is converted again without it (see valid_text_entries)
+    """
+    try:
+        if include_id:
+            return [(int(r['id']), int(r['reading']), datetime.fromisoformat(r['timestamp'])) for r in payloads] # make sure data is in correct format for postgres
+        return [(int(r['reading']), datetime.fromisoformat(r['timestamp'])) for r in payloads]
+    except (KeyError, ValueError, TypeError):
+        valid = valid_text_entries(payloads)
+        if len(valid) == len(payloads): # nothing to skip, the failure is not a malformed entry
+            raise
+        return text_records(valid, include_id)
+
+def valid_text_entries(payloads: list[dict]) -> list[dict]:
+    """
+    Text entries whose fields are all present, parse and fit their columns (bigint id, smallint reading)
+    The others are logged and skipped like malformed binary entries (see split_entries). Skipped entries are still acknowledged
+    Only called once a batch failed to convert, so the common path pays nothing for it
+    """
+    valid = []
+    for payload in payloads:
+        try:
+            id, reading = int(payload['id']), int(payload['reading'])
+            datetime.fromisoformat(payload['timestamp'])
+        except (KeyError, ValueError, TypeError):
+            continue
+        if -9223372036854775808 <= id <= 9223372036854775807 and -32768 <= reading <= 32767:
+            valid.append(payload)
+    if len(valid) < len(payloads):
+        logger.error(f'Skipped {len(payloads) - len(valid)} malformed stream entries out of {len(payloads)}')
+    return valid
+
+def binary_records(payloads: list[dict], include_id: bool = True) -> list[tuple]:
+    """
+    Converts stream entries read without decode_responses into records for copy_records_to_table
+    Entries still in the text format (written before WIRE_FORMAT was switched) are converted one by one
+    so the stream does not need to be drained before changing formats, malformed entries are skipped (see split_entries)
+    Building a datetime per record costs more than the text path saves, the worker COPYs binary entries
+    with the binary COPY buffer instead (see workers/core.py copy_batch)
+    """
+    return to_records(decode_entries(payloads, binary=True), include_id)
+
+def parse_timestamps(timestamps: list[str]) -> np.ndarray:
+    """
+    Parses ISO-8601 timestamps into microseconds since the unix epoch
+    The producer always writes UTC ('+00:00'), numpy can parse those in one call once the offset is stripped
+    Any other offset falls back to datetime.fromisoformat one by one
+    """
+    if all(ts.endswith('+00:00') for ts in timestamps):
+        return np.array([ts[:-6] for ts in timestamps], dtype='datetime64[us]').astype(np.int64)
+    return np.array([to_epoch_us(datetime.fromisoformat(ts)) for ts in timestamps], dtype=np.int64)
+
+def split_entries(payloads: list[dict]) -> tuple[list[bytes], list[tuple[int, int, int]]]:
+    """
+    Separates entries read without decode_responses into binary blobs and text entries already parsed into
+    (id, reading, epoch microseconds) tuples
+    Malformed entries (a blob of the wrong size, a text entry with missing or invalid fields) are logged and skipped,
+    so one bad entry can't fail every flush of its batch and be reclaimed forever. Skipped entries are still acknowledged
+    """
+    blobs = []
+    legacy = []
+    skipped = 0
+    for payload in payloads:
+        blob = payload.get(BINARY_FIELD_BYTES)
+        try:
+            if blob is None:
+                legacy.append((int(payload[b'id']), int(payload[b'reading']), to_epoch_us(datetime.fromisoformat(payload[b'timestamp'].decode()))))
+            elif len(blob) == WIRE_DTYPE.itemsize:
+                blobs.append(blob)
+            else:
+                skipped += 1
+        except (KeyError, ValueError):
+            skipped += 1
+    if skipped:
+        logger.error(f'Skipped {skipped} malformed stream entries out of {len(payloads)}')
+    return blobs, legacy
+
+def decode_entries(payloads: list[dict], binary: bool) -> np.ndarray:
+    """
+    Decodes a batch of stream entries into a WIRE_DTYPE structured array, whichever format they were written in
+    binary=True for entries read without decode_responses (WIRE_FORMAT binary), text entries among them are converted one by one
+    Malformed entries are skipped in either format
+    """
+    if not binary:
+        batch = np.empty(len(payloads), dtype=WIRE_DTYPE)
+        try:
+            batch['id'] = [int(r['id']) for r in payloads]
+            batch['reading'] = [int(r['reading']) for r in payloads]
+            batch['timestamp'] = parse_timestamps([r['timestamp'] for r in payloads])
+        except (KeyError, ValueError, TypeError, OverflowError): # OverflowError: a value that doesn't fit its column
+            valid = valid_text_entries(payloads)
+            if len(valid) == len(payloads):
+                raise
+            return decode_entries(valid, binary)
+        return batch
+
+    blobs, legacy = split_entries(payloads)
+    batch = decode_batch(blobs)
+    if legacy:
+        batch = np.concatenate([batch, np.array(legacy, dtype=WIRE_DTYPE)])
+    return batch
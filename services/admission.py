@@ -0,0 +1,89 @@
+import asyncio
+import logging
+
+import redis.asyncio as redis
+
+logger = logging.getLogger('iot-firehose-logger')
+
+class AdmissionController:
+    """
+    Sheds load before Redis runs out of memory when the workers fall behind
+    A background task refreshes each stream's backlog (consumer group lag + pending entries) and length,
+    and Redis' used memory, every REFRESH seconds
+    Requests only compare against these cached values, so admission never adds a Redis call to the hot path
+    """
+    def __init__(self, client: redis.Redis, streams: list[str], group: str, max_backlog: int,
+                 max_length: int, max_memory: int, refresh: float) -> None:
+        self.client = client
+        self.streams = streams
+        self.group = group
+        self.max_backlog = max_backlog
+        self.max_length = max_length
+        self.max_memory = max_memory
+        self.refresh = refresh
+        self.backlog: dict[str, int] = {stream: 0 for stream in streams} # entries not yet acknowledged by the workers
+        self.length: dict[str, int] = {stream: 0 for stream in streams}
+        self.memory: int = 0 # bytes used by Redis
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Starts the refresh task, must be called from inside the running event loop (e.g. the FastAPI lifespan)"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancels the refresh task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def admit(self, stream: str) -> int | None:
+        """
+        Returns None if a write to STREAM is within budget, otherwise the status code to reject it with:
+        429 when the workers are too far behind on this stream (the backlog will clear)
+        503 when the stream or Redis memory is over budget
+        """
+        if self.length[stream] > self.max_length or (self.max_memory and self.memory > self.max_memory):
+            return 503
+        if self.backlog[stream] > self.max_backlog:
+            return 429
+        return None
+
+    async def _run(self) -> None:
+        """
+        Refresh loop, keeps the last known values if Redis cannot be reached
+        """
+        while True:
+            try:
+                await self._refresh()
+            except Exception as e:
+                logger.error(f'Admission controller failed to refresh stream state: {e}')
+            await asyncio.sleep(self.refresh)
+
+    async def _refresh(self) -> None:
+        """
+        Reads XINFO GROUPS and XLEN for every stream plus INFO memory in one pipelined round trip
+        """
+        async with self.client.pipeline(transaction=False) as pipe:
+            for stream in self.streams:
+                pipe.xinfo_groups(stream)
+                pipe.xlen(stream)
+            pipe.info('memory')
+            results = await pipe.execute(raise_on_error=False) # a stream without a consumer group yet is not an error worth failing on
+
+        for i, stream in enumerate(self.streams):
+            groups, length = results[2 * i], results[2 * i + 1]
+            if isinstance(length, Exception):
+                continue
+            self.length[stream] = length
+            backlog = length # no consumer group yet: nothing has been delivered
+            if not isinstance(groups, Exception):
+                for group in groups:
+                    if group['name'] == self.group:
+                        lag = group.get('lag') # undelivered entries, None when Redis cannot tell (e.g. after XDEL)
+                        backlog = group['pending'] + (lag if lag is not None else length)
+            self.backlog[stream] = backlog
+        if not isinstance(results[-1], Exception):
+            self.memory = results[-1]['used_memory']
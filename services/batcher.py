@@ -0,0 +1,67 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any
+
+class MicroBatcher(ABC):
+    """
+    Gathers items from many concurrent requests into batches handled by a single task
+    Requests enqueue an item and await a future that _flush resolves once the batch holding it has been handled
+    The task handles the queue WINDOW seconds after its first item arrives, or as soon as MAX_BATCH items are waiting.
+    Items that arrive during a flush form the next batch
+    Subclasses implement _flush(batch), where batch is a list of the enqueued items with their future appended
+    """
+    def __init__(self, window: float, max_batch: int) -> None:
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: list[tuple] = [] # (*item, future) waiting for the next flush
+        self._wakeup = asyncio.Event() # set when the first item of a new batch arrives
+        self._full = asyncio.Event() # set when MAX_BATCH items are waiting, cuts the window short
+        self._task: asyncio.Task | None = None
+        self._closing: bool = False # set on shutdown, the task skips the window and exits once the queue is empty
+
+    def start(self) -> None:
+        """Starts the batching task, must be called from inside the running event loop (e.g. the FastAPI lifespan)"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Lets the task handle anything still queued, then waits for it to exit so no request is left hanging"""
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        if self._task is not None:
+            await self._task
+
+    async def _enqueue(self, *item) -> Any:
+        """Adds ITEM to the next batch and waits for its result"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((*item, future))
+        if len(self._pending) == 1:
+            self._wakeup.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _run(self) -> None:
+        """
+        Batching loop, waits for a first item then gives other requests up to WINDOW seconds to join the batch
+        """
+        while True:
+            await self._wakeup.wait()
+            if self._closing and not self._pending:
+                return
+            if len(self._pending) < self.max_batch and not self._closing:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.window)
+                except asyncio.TimeoutError:
+                    pass
+
+            self._wakeup.clear()
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if self._pending or self._closing: # items that overflowed MAX_BATCH start the next batch straight away
+                self._wakeup.set()
+            await self._flush(batch)
+
+    @abstractmethod
+    async def _flush(self, batch: list[tuple]) -> None:
+        """Handles BATCH and resolves the future of every item in it"""
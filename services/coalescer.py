@@ -0,0 +1,57 @@
+import asyncio
+
+import redis.asyncio as redis
+from redis.exceptions import NoScriptError
+
+from services.batcher import MicroBatcher
+from services.idempotency import queue_xadd_once, xadd_once
+
+class XaddCoalescer(MicroBatcher):
+    """
+    Coalesces concurrent XADDs from many requests into one pipelined round trip
+    Requests enqueue their entry and await a future that resolves with the Redis entry ID once it is written
+    The batching task (see MicroBatcher) sends the queue after WINDOW seconds or as soon as MAX_BATCH entries are waiting
+    Exposes the same xadd(name, fields) signature as the redis client so the two are interchangeable
+    xadd_once entries (IDEMPOTENCY) join the same pipeline
+    """
+    def __init__(self, client: redis.Redis, window: float, max_batch: int) -> None:
+        super().__init__(window, max_batch)
+        self.client = client
+
+    async def xadd(self, name: str, fields: dict) -> str:
+        """Queues an entry and waits until it has been written to the stream"""
+        return await self._enqueue(name, fields, None)
+
+    async def xadd_once(self, key: str, ttl: int, name: str, fields: dict) -> str | None:
+        """Queues an entry that is skipped if KEY was seen in the last TTL seconds, see services.idempotency.xadd_once"""
+        return await self._enqueue(name, fields, (key, ttl))
+
+    async def _flush(self, batch: list[tuple[str, dict, tuple[str, int] | None, asyncio.Future]]) -> None:
+        """
+        Writes a batch in one pipelined round trip and resolves every request's future with its own result
+        """
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for name, fields, dedup, _ in batch:
+                    if dedup is None:
+                        pipe.xadd(name, fields) # type: ignore
+                    else:
+                        queue_xadd_once(pipe, dedup[0], dedup[1], name, fields)
+                results = await pipe.execute(raise_on_error=False) # one bad entry should not fail the other requests
+        except Exception as e: # connection level failure, every request in the batch failed
+            results = [e] * len(batch)
+
+        for i, ((name, fields, dedup, _), result) in enumerate(zip(batch, results)):
+            if isinstance(result, NoScriptError): # script not cached by Redis yet, only happens once after a restart
+                try:
+                    results[i] = await xadd_once(self.client, dedup[0], dedup[1], name, fields) # type: ignore
+                except Exception as e:
+                    results[i] = e
+
+        for (_, _, _, future), result in zip(batch, results):
+            if future.done(): # the request was cancelled, e.g. client disconnected
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncGenerator, Literal
+
+from asyncpg import Pool
+
+logger = logging.getLogger('iot-firehose-logger')
+
+EXPORT_QUERY = 'SELECT id, reading, timestamp FROM readings2 WHERE timestamp >= $1 AND timestamp < $2'
+MEDIA_TYPES = {'csv': 'text/csv', 'binary': 'application/octet-stream'} # binary is PostgreSQL's COPY binary format
+
+async def export_readings(pool: Pool, start: datetime, end: datetime, format: Literal['csv', 'binary'],
+                          max_chunks: int) -> AsyncGenerator[bytes, None]:
+    """
+    Streams readings2 rows with timestamp in [START, END) as COPY ... TO STDOUT output, chunk by chunk, in no particular order
+    A background task runs the COPY on a pooled connection and hands chunks over through a queue of MAX_CHUNKS,
+    while the queue is full the COPY waits and asyncpg stops reading from the socket, so memory stays bounded
+    Closing the generator (e.g. the client disconnected) cancels the task, which cancels the query on the server
+    """
+    chunks: asyncio.Queue[bytes | BaseException | None] = asyncio.Queue(maxsize=max_chunks)
+
+    async def copy() -> None:
+        try:
+            async with pool.acquire() as conn:
+                await conn.copy_from_query(EXPORT_QUERY, start, end, output=chunks.put, format=format,
+                                           header=True if format == 'csv' else None)
+            await chunks.put(None) # end of export
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'Export from {start} to {end} failed: {e}')
+            await chunks.put(e)
+
+    task = asyncio.create_task(copy())
+    try:
+        while (chunk := await chunks.get()) is not None:
+            if isinstance(chunk, BaseException):
+                raise chunk # the response has already started, this aborts it so the client sees a truncated body
+            yield chunk
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
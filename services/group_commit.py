@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from datetime import datetime
+from time import time_ns
+from typing import Awaitable, Callable
+
+from asyncpg import Pool
+from asyncpg.exceptions import UniqueViolationError
+
+from config.database_config import create_staging_table, insert_from_staging_returning
+from config.metrics import timed_acquire
+from schemas.db_model import DatabasePayload
+from schemas.wire import to_epoch_us
+from services.batcher import MicroBatcher
+
+logger = logging.getLogger('iot-firehose-logger')
+
+COLUMNS = ('id', 'reading', 'timestamp')
+
+def row_key(id: int, reading: int, timestamp: datetime) -> tuple[int, int, int]:
+    """Compares a request's reading with a row returned by Postgres, whatever time zone either timestamp is in"""
+    return id, reading, to_epoch_us(timestamp)
+
+class DuplicateReading(Exception):
+    """A reading whose id already exists in readings, nothing was written for it"""
+
+class GroupCommitter(MicroBatcher):
+    """
+    Group commit of readings straight into Postgres, no Redis in the path
+    Requests enqueue their reading and await a future that resolves once the transaction holding it has committed
+    The batching task (see MicroBatcher) COPYs everything queued in one transaction, after MAX_WAIT seconds or as soon as
+    MAX_BATCH readings are waiting. Requests that arrive during a commit form the next group
+    ON_COMMIT, if given, is awaited with the readings of each group that were written, after their requests are answered
+    """
+    def __init__(self, pool: Pool, max_wait: float, max_batch: int,
+                 on_commit: Callable[[list[DatabasePayload]], Awaitable[None]] | None = None) -> None:
+        super().__init__(max_wait, max_batch)
+        self.pool = pool
+        self.on_commit = on_commit
+
+    async def submit(self, reading: DatabasePayload) -> None:
+        """
+        Queues a reading and returns once it has been committed
+        Raises DuplicateReading if its id already exists, or whatever failed the commit
+        """
+        await self._enqueue(reading)
+
+    async def _flush(self, group: list[tuple[DatabasePayload, asyncio.Future]]) -> None:
+        """
+        COPYs a group in one transaction and resolves every request's future
+        If the group hits an existing id it is redone through the staging table, so only the duplicates fail
+        """
+        records = [(reading.id, reading.reading, reading.timestamp) for reading, _ in group]
+        duplicates: list[bool] = [False] * len(group)
+        try:
+            async with timed_acquire(self.pool, 'group_commit') as conn:
+                try:
+                    async with conn.transaction():
+                        await conn.copy_records_to_table('readings', records=records, columns=COLUMNS)
+                except UniqueViolationError: # rolled back, redo the group without the duplicates
+                    async with conn.transaction():
+                        staging = await create_staging_table(conn, 'readings')
+                        await conn.copy_records_to_table(staging, records=records, columns=COLUMNS)
+                        kept = await insert_from_staging_returning(conn, 'readings', staging, COLUMNS)
+                    remaining: dict[tuple, int] = {}
+                    for row in kept: # a row written for several identical requests succeeds only the first
+                        key = row_key(row['id'], row['reading'], row['timestamp'])
+                        remaining[key] = remaining.get(key, 0) + 1
+                    for i, record in enumerate(records):
+                        key = row_key(*record)
+                        if remaining.get(key, 0):
+                            remaining[key] -= 1
+                        else:
+                            duplicates[i] = True
+        except Exception as e: # nothing in the group was committed
+            logger.error(f'Group commit of {len(group)} readings failed at time {time_ns()}: {e}')
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), duplicate in zip(group, duplicates):
+            if future.done(): # the request was cancelled, e.g. client disconnected, its reading is committed regardless
+                continue
+            if duplicate:
+                future.set_exception(DuplicateReading())
+            else:
+                future.set_result(None)
+        if self.on_commit is not None:
+            await self.on_commit([reading for (reading, _), duplicate in zip(group, duplicates) if not duplicate])
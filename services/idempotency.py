@@ -0,0 +1,39 @@
+from hashlib import sha1
+
+import redis.asyncio as redis
+from redis.exceptions import NoScriptError
+
+# Claims the dedup key and appends the entry in one atomic step, so a reading is never marked seen without being written.
+# KEYS: dedup key, stream. ARGV: TTL in seconds, then the entry's field/value pairs. Returns the entry ID, or nil for a duplicate
+XADD_ONCE = '''
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[1]) then
+    return redis.call('XADD', KEYS[2], '*', unpack(ARGV, 2))
+end
+return false
+'''
+XADD_ONCE_SHA = sha1(XADD_ONCE.encode()).hexdigest()
+
+def xadd_once_args(key: str, ttl: int, name: str, fields: dict) -> list:
+    """EVALSHA/EVAL arguments after the script for one entry"""
+    args: list = [2, key, name, ttl]
+    for field, value in fields.items():
+        args.extend((field, value))
+    return args
+
+def queue_xadd_once(pipe: redis.client.Pipeline, key: str, ttl: int, name: str, fields: dict) -> None:
+    """
+    Queues XADD_ONCE on PIPE by SHA only, redis-py's Script objects would add a SCRIPT EXISTS round trip to every pipeline
+    The result is a NoScriptError if Redis doesn't have the script cached yet, retry those with xadd_once
+    """
+    pipe.evalsha(XADD_ONCE_SHA, *xadd_once_args(key, ttl, name, fields))
+
+async def xadd_once(client: redis.Redis, key: str, ttl: int, name: str, fields: dict) -> str | None:
+    """
+    XADDs the entry unless KEY was seen in the last TTL seconds, in one round trip
+    Returns the entry ID, or None if it was a duplicate
+    """
+    args = xadd_once_args(key, ttl, name, fields)
+    try:
+        return await client.evalsha(XADD_ONCE_SHA, *args) # type: ignore
+    except NoScriptError: # first use since Redis started, EVAL caches the script for the following EVALSHAs
+        return await client.eval(XADD_ONCE, *args) # type: ignore
@@ -0,0 +1,166 @@
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from hashlib import sha1
+from time import monotonic
+
+import numpy as np
+import redis.asyncio as redis
+from asyncpg import Pool
+from redis.exceptions import NoScriptError
+
+from schemas.db_model import DatabasePayload, LatestReading
+from schemas.wire import EPOCH, to_epoch_us
+
+logger = logging.getLogger('iot-firehose-logger')
+
+# Hash values are '<timestamp in unix microseconds>:<reading>'. Only moves a device forward in time, so batches
+# flushed out of order (concurrent flushers, reclaimed entries) or a late database fallback never regress it
+SET_LATEST = '''
+for i = 1, #ARGV, 3 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if not current or tonumber(string.match(current, '^(-?%d+)')) < tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1] .. ':' .. ARGV[i + 2])
+    end
+end
+'''
+
+SET_LATEST_SHA = sha1(SET_LATEST.encode()).hexdigest()
+
+def latest_per_device(batch: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Newest reading of each device in a decoded batch (schemas.wire.WIRE_DTYPE)
+    Returns (ids, timestamps in unix microseconds, readings), one element per device
+    """
+    order = np.lexsort((batch['timestamp'], batch['id'])) # sorts by id, then timestamp
+    ids = batch['id'][order]
+    last = np.flatnonzero(np.r_[ids[1:] != ids[:-1], True]) # last row of each id
+    return ids[last], batch['timestamp'][order][last], batch['reading'][order][last]
+
+def queue_latest(pipe: redis.client.Pipeline, hash_name: str, batch: np.ndarray) -> None:
+    """
+    Queues the batch's newest reading per device on PIPE, so the worker updates the cache in the same round trip as its XACK
+    Queued by SHA only, redis-py's Script objects would add a SCRIPT EXISTS round trip to every pipeline
+    Executing PIPE raises NoScriptError if Redis doesn't have the script cached yet, load it with load_latest and retry
+    """
+    if not len(batch):
+        return
+    ids, timestamps, readings = latest_per_device(batch)
+    args = np.column_stack((ids, timestamps, readings)).ravel().tolist() # id, timestamp, reading, id, ...
+    pipe.evalsha(SET_LATEST_SHA, 1, hash_name, *args)
+
+async def load_latest(client: redis.Redis) -> None:
+    """Caches SET_LATEST in Redis, so pipelines that queue it by SHA can run"""
+    await client.script_load(SET_LATEST) # type: ignore
+
+async def set_latest(client: redis.Redis, hash_name: str, args: list) -> None:
+    """
+    Runs SET_LATEST with ARGS (id, timestamp, reading, id, ...) in one round trip, EVALSHA with an EVAL fallback
+    """
+    try:
+        await client.evalsha(SET_LATEST_SHA, 1, hash_name, *args) # type: ignore
+    except NoScriptError: # first use since Redis started, EVAL caches the script for the following EVALSHAs
+        await client.eval(SET_LATEST, 1, hash_name, *args) # type: ignore
+
+def decode_latest(id: int, value: str) -> LatestReading:
+    """Parses a hash value written by SET_LATEST"""
+    timestamp, reading = value.split(':')
+    return LatestReading(id=id, reading=int(reading), timestamp=EPOCH + timedelta(microseconds=int(timestamp)))
+
+class LatestCache:
+    """
+    Latest reading per device for the read endpoints, looked up in three tiers:
+    - an in-process LRU of SIZE devices whose entries expire after TTL seconds, so every API process sees new readings soon
+    - the Redis hash HASH_NAME, kept current by the worker as it flushes
+    - an indexed query on readings, whose result is written back to the hash
+    The hash is only used with SHARED (LATEST_CACHE), otherwise nothing keeps it current, so its first answer for a device
+    would be served forever. Without it, misses in the LRU go straight to the database
+    Devices with no readings are cached as missing too, so polling an unknown id does not hit the database every time
+    """
+    def __init__(self, client: redis.Redis, pool: Pool, hash_name: str, size: int, ttl: float, shared: bool) -> None:
+        self.client = client
+        self.pool = pool
+        self.hash_name = hash_name
+        self.shared = shared
+        self.size = size
+        self.ttl = ttl
+        self.entries: OrderedDict[int, tuple[float, LatestReading | None]] = OrderedDict() # id -> (expiry, reading)
+
+    async def get(self, id: int) -> LatestReading | None:
+        """Latest reading of device ID, None if it has none"""
+        return (await self.get_many([id])).get(id)
+
+    async def get_many(self, ids: list[int]) -> dict[int, LatestReading]:
+        """
+        Latest reading of each device in IDS in request order, devices without readings are left out
+        Each tier is asked only for what the previous one missed, in one call per tier
+        """
+        now = monotonic()
+        found: dict[int, LatestReading] = {}
+        misses: list[int] = []
+        for id in dict.fromkeys(ids): # dedupe, keeping order
+            entry = self.entries.get(id)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(id)
+                if entry[1] is not None:
+                    found[id] = entry[1]
+            else:
+                misses.append(id)
+        if not misses:
+            return found
+
+        missing: list[int] = misses
+        if self.shared:
+            missing = []
+            for id, value in zip(misses, await self.client.hmget(self.hash_name, misses)): # type: ignore
+                if value is None:
+                    missing.append(id)
+                else:
+                    found[id] = self._store(id, decode_latest(id, value), now)
+        if missing:
+            found.update(await self._query(missing, now))
+        return {id: found[id] for id in dict.fromkeys(ids) if id in found} # in request order
+
+    async def _query(self, ids: list[int], now: float) -> dict[int, LatestReading]:
+        """
+        Database fallback, one DISTINCT ON query served by the primary key index
+        With SHARED, writes what it finds back to the hash (through SET_LATEST, so a newer reading flushed meanwhile wins)
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT DISTINCT ON (id) id, reading, timestamp FROM readings
+                WHERE id = ANY($1::bigint[])
+                ORDER BY id, timestamp DESC
+            ''', ids)
+        found = {row['id']: self._store(row['id'], LatestReading(**row), now) for row in rows}
+        for id in ids:
+            if id not in found:
+                self._store(id, None, now)
+        if rows and self.shared:
+            args = [value for row in rows for value in (row['id'], to_epoch_us(row['timestamp']), row['reading'])]
+            await set_latest(self.client, self.hash_name, args)
+        return found
+
+    async def written(self, readings: list[DatabasePayload]) -> None:
+        """
+        Readings committed without going through the worker (/readings/slow/*, /readings/durable)
+        This process' LRU forgets their devices, and with SHARED they go to the hash as the worker's would
+        The readings are already committed, so a failed hash update is only logged
+        """
+        for reading in readings:
+            self.entries.pop(reading.id, None)
+        if not self.shared or not readings:
+            return
+        args = [value for reading in readings for value in (reading.id, to_epoch_us(reading.timestamp), reading.reading)] # type: ignore
+        try:
+            await set_latest(self.client, self.hash_name, args)
+        except Exception as e:
+            logger.error(f'Could not update the latest value cache with {len(readings)} readings: {e}')
+
+    def _store(self, id: int, reading: LatestReading | None, now: float) -> LatestReading | None:
+        """Caches READING for device ID until NOW + TTL, evicting the least recently used device if full"""
+        self.entries[id] = (now + self.ttl, reading)
+        self.entries.move_to_end(id)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return reading
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import AsyncGenerator
+
+import numpy as np
+import orjson
+import redis.asyncio as redis
+
+from schemas.wire import decode_entries
+
+logger = logging.getLogger('iot-firehose-logger')
+
+KEEPALIVE = b': keepalive\n\n' # SSE comment, keeps proxies from closing an idle stream
+CLOSED = b'' # queued by stop() to end every stream
+
+def event(batch: np.ndarray) -> bytes:
+    """
+    One SSE event for a decoded batch, as JSON columns: id, reading and timestamp in microseconds since the unix epoch
+    """
+    return b'data: ' + orjson.dumps({
+        'id': batch['id'].tolist(),
+        'reading': batch['reading'].tolist(),
+        'timestamp': batch['timestamp'].tolist(),
+    }) + b'\n\n'
+
+class Subscription:
+    """
+    One live tail client: its device id filter (None for every device) and a bounded queue of SSE events
+    A client that falls behind loses its oldest queued event for every new one, so it always catches up
+    to recent data and never holds up the reader or the other clients
+    """
+    def __init__(self, ids: list[int] | None, size: int) -> None:
+        self.ids = np.array(sorted(set(ids)), dtype=np.int64) if ids else None
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=size)
+        self.dropped: int = 0 # events dropped so far
+
+    def offer(self, frame: bytes) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+class LiveTail:
+    """
+    Fans readings out to live dashboards (SSE clients) from a single XREAD loop per API process
+    Redis sees one blocking XREAD over every stream per round whatever the number of clients, and none without clients:
+    the reader starts with the first subscriber and exits once the last one leaves
+    Each batch is decoded once and serialized once for every unfiltered client, filtered clients get their own slice
+    Plain XREAD from the tail ('$'), not the consumer group, so the workers' deliveries and PEL are untouched
+    """
+    BLOCK_MS: int = 1000 # longest an XREAD waits, bounds how long the reader outlives its last client
+    COUNT: int = 1000 # entries per stream per XREAD
+
+    def __init__(self, client: redis.Redis, streams: list[str], binary: bool, queue_size: int, keepalive: float) -> None:
+        self.client = client
+        self.streams = streams
+        self.binary = binary # entries are read back as raw bytes in WIRE_FORMAT binary, the client must not decode responses
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.subscribers: set[Subscription] = set()
+        self._task: asyncio.Task | None = None
+
+    async def stop(self) -> None:
+        """Ends every client's stream and cancels the reader"""
+        for subscription in self.subscribers:
+            subscription.offer(CLOSED)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def stream(self, ids: list[int] | None) -> AsyncGenerator[bytes, None]:
+        """
+        SSE frames for one client until it disconnects, readings of IDS only if given
+        A 'dropped' event with the running count comes before the next data event whenever events were dropped
+        """
+        subscription = Subscription(ids, self.queue_size)
+        self.subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        reported = 0
+        try:
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscription.queue.get(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+                    continue
+                if frame == CLOSED:
+                    return
+                if subscription.dropped > reported:
+                    reported = subscription.dropped
+                    yield b'event: dropped\ndata: ' + orjson.dumps({'dropped': reported}) + b'\n\n'
+                yield frame
+        finally: # client disconnected, the response task is cancelled here
+            self.subscribers.discard(subscription)
+
+    async def _run(self) -> None:
+        """
+        Reader loop, from the entries added after the first client subscribed until no client is left
+        """
+        last: dict[str, str | bytes] = {stream: '$' for stream in self.streams}
+        while self.subscribers:
+            try:
+                readings = await self.client.xread(last, count=self.COUNT, block=self.BLOCK_MS) # type: ignore
+            except Exception as e:
+                logger.error(f'Live tail failed to read the stream: {e}')
+                await asyncio.sleep(1)
+                continue
+            for stream, messages in readings or []:
+                last[stream.decode() if isinstance(stream, bytes) else stream] = messages[-1][0]
+                payloads = [payload for _, payload in messages if payload]
+                if not payloads:
+                    continue
+                try:
+                    batch = decode_entries(payloads, self.binary)
+                except (KeyError, ValueError) as e: # a malformed entry only costs the dashboards this batch
+                    logger.error(f'Live tail could not decode {len(payloads)} entries: {e}')
+                    continue
+                self._publish(batch)
+
+    def _publish(self, batch: np.ndarray) -> None:
+        """Queues BATCH to every client, the unfiltered event is serialized at most once"""
+        shared = None
+        for subscription in self.subscribers:
+            if subscription.ids is None:
+                if shared is None:
+                    shared = event(batch)
+                subscription.offer(shared)
+            else:
+                selected = batch[np.isin(batch['id'], subscription.ids)]
+                if len(selected):
+                    subscription.offer(event(selected))
@@ -0,0 +1,21 @@
+import random
+
+from locust import FastHttpUser, task, constant
+
+# important: remember to start redis worker in separate terminal using python -m workers.process_safe_worker
+
+BATCH_SIZE = 100 # readings sent per request
+
+class BatchThroughputUser(FastHttpUser):
+    """
+    Sends post request to /fast/batch endpoint with BATCH_SIZE readings per request
+    Instead of using a counter, rely on readings2 table's identity column
+    Locust reports requests per second, multiply by BATCH_SIZE for readings per second
+    FastHttpUser is more CPU efficient and designed for high throughput testing
+    """
+    wait_time = constant(0) # make the users send requests as fast as possible
+
+    @task
+    def send_batch_request(self):
+        ENDPOINT = '/fast/batch'
+        self.client.post(f'readings{ENDPOINT}', json=[{'id': 0, 'reading': random.randint(0, 100)} for _ in range(BATCH_SIZE)])
@@ -0,0 +1,18 @@
+import random
+from itertools import count
+
+from locust import FastHttpUser, task
+
+counter = count(start=1) # using global counter to update primary key id in a thread safe way
+
+class DurableRequest(FastHttpUser):
+    """
+    Sends post request to /durable endpoint (group commit)
+    Every response arrives only after the reading is committed, compare with /slow/pooling at the same user count
+    Global counter is used to update primary key
+    """
+    @task
+    def send_durable_request(self):
+        ENDPOINT = '/durable'
+        id = next(counter)
+        self.client.post(f'/readings{ENDPOINT}', json={'id':id, 'reading': random.randint(0, 100)})
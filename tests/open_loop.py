@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+from time import perf_counter, time, time_ns
+
+import httpx
+
+# Open loop load generator: requests are sent on a fixed schedule whether or not earlier ones have been answered,
+# and latency is measured from the time each request was due, not from when it was actually sent.
+# A closed loop generator (Locust with wait_time = constant(0)) stops sending while the server is slow,
+# so the queueing delay those requests would have seen is never measured (coordinated omission)
+# Usage: python tests/open_loop.py --endpoint fast --rate 2000,4000,8000 --duration 30 --processes 4
+
+ENDPOINTS = { # name -> path, sent with ids (readings2 endpoints use its identity column instead)
+    'fast': '/readings/fast',
+    'lean': '/readings/fast/lean',
+    'batch': '/readings/fast/batch',
+    'pooling': '/readings/slow/pooling',
+    'durable': '/readings/durable',
+}
+PERCENTILES = (50, 90, 99, 99.9, 99.99)
+
+class LatencyHistogram:
+    """
+    HDR style histogram of latencies in microseconds, with about 1% precision (2 significant digits) up to MAX_US
+    Values below SUB_BUCKETS are counted exactly. Above that, each power of two range is split into HALF linear
+    sub-buckets, so recording is a bit_length and a shift, and memory is a few thousand counters whatever the count
+    Histograms from several processes are merged by adding their counts
+    """
+    SUB_BITS = 8
+    SUB_BUCKETS = 1 << SUB_BITS # 256
+    HALF = SUB_BUCKETS // 2
+    MAX_US = 3_600_000_000 # one hour, larger values are counted as MAX_US
+
+    def __init__(self, counts: list[int] | None = None) -> None:
+        self.counts = counts or [0] * (self.index(self.MAX_US) + 1)
+
+    @classmethod
+    def index(cls, value: int) -> int:
+        """Bucket of VALUE microseconds"""
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS
+        return cls.SUB_BUCKETS + (shift - 1) * cls.HALF + (value >> shift) - cls.HALF
+
+    @classmethod
+    def highest(cls, index: int) -> int:
+        """Largest value counted in bucket INDEX, percentiles are reported as this so they never understate"""
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = (index - cls.SUB_BUCKETS) // cls.HALF + 1
+        top = (index - cls.SUB_BUCKETS) % cls.HALF + cls.HALF
+        return ((top + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        self.counts[self.index(min(max(value, 0), self.MAX_US))] += 1
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, percent: float) -> int:
+        """Smallest recorded value (to bucket precision) that PERCENT of the values are at or below"""
+        total = self.total()
+        if not total:
+            return 0
+        target = max(1, round(total * percent / 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.highest(i)
+        return self.MAX_US
+
+    def max(self) -> int:
+        for i in range(len(self.counts) - 1, -1, -1):
+            if self.counts[i]:
+                return self.highest(i)
+        return 0
+
+def body(endpoint: str, id: int, batch_size: int) -> list | dict:
+    """JSON body for one request, batch requests carry BATCH_SIZE readings with consecutive ids"""
+    if endpoint == 'batch':
+        return [{'id': id + i, 'reading': random.randint(-32768, 32767)} for i in range(batch_size)]
+    return {'id': id, 'reading': random.randint(-32768, 32767)}
+
+async def generate(url: str, endpoint: str, rate: float, duration: float, first_id: int, batch_size: int,
+                   connections: int, timeout: float, start_at: float) -> dict:
+    """
+    Sends RATE requests per second for DURATION seconds starting at wall clock time START_AT, ids from FIRST_ID up
+    Every request is its own task started at its scheduled time, a slow response never delays the next send.
+    Requests waiting for one of the CONNECTIONS pooled connections are still timed from their scheduled time
+    Errors and timeouts are recorded at the time they failed, so failing requests still count towards the latency
+    """
+    histogram = LatencyHistogram()
+    statuses: dict[str, int] = {}
+    max_lag = 0.0 # furthest the sender fell behind its schedule, large values mean this process is the bottleneck
+    requests = int(rate * duration)
+    interval = 1 / rate
+    path = ENDPOINTS[endpoint]
+    ids_per_request = batch_size if endpoint == 'batch' else 1
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+        async def send(scheduled: float, id: int) -> None:
+            try:
+                response = await client.post(path, json=body(endpoint, id, batch_size))
+                outcome = str(response.status_code)
+            except httpx.TimeoutException:
+                outcome = 'timeout'
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+            histogram.record(int((perf_counter() - scheduled) * 1_000_000))
+            statuses[outcome] = statuses.get(outcome, 0) + 1
+
+        await asyncio.sleep(max(0, start_at - time()))
+        start = perf_counter()
+        tasks = set()
+        sent = 0
+        while sent < requests:
+            now = perf_counter()
+            due = min(requests, int((now - start) / interval) + 1) # every request whose time has come, in a burst if the loop fell behind
+            for n in range(sent, due):
+                scheduled = start + n * interval
+                max_lag = max(max_lag, now - scheduled)
+                task = asyncio.create_task(send(scheduled, first_id + n * ids_per_request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            sent = due
+            await asyncio.sleep(max(0, start + sent * interval - perf_counter()))
+        if tasks:
+            await asyncio.wait(tasks) # every request is bounded by TIMEOUT
+        elapsed = perf_counter() - start
+
+    return {'counts': histogram.counts, 'statuses': statuses, 'max_lag': max_lag, 'elapsed': elapsed}
+
+def run_process(args: tuple) -> dict:
+    """Entry point of each generator process"""
+    return asyncio.run(generate(*args))
+
+def run_rate(options: argparse.Namespace, rate: float, first_id: int) -> dict:
+    """
+    Drives RATE requests per second split evenly over the generator processes, each with its own id range
+    Returns the merged results
+    """
+    per_process = rate / options.processes
+    ids_per_process = int(per_process * options.duration) * (options.batch_size if options.endpoint == 'batch' else 1)
+    start_at = time() + 1 # gives every process time to start so they begin together
+    jobs = [(options.url, options.endpoint, per_process, options.duration, first_id + i * ids_per_process,
+             options.batch_size, options.connections, options.timeout, start_at) for i in range(options.processes)]
+    with multiprocessing.Pool(options.processes) as pool:
+        results = pool.map(run_process, jobs)
+
+    histogram = LatencyHistogram()
+    statuses: dict[str, int] = {}
+    for result in results:
+        histogram.merge(LatencyHistogram(result['counts']))
+        for outcome, count in result['statuses'].items():
+            statuses[outcome] = statuses.get(outcome, 0) + count
+    elapsed = max(result['elapsed'] for result in results)
+    return {
+        'target_rate': rate,
+        'achieved_rate': histogram.total() / elapsed,
+        'statuses': statuses,
+        'latency_ms': {str(p): histogram.percentile(p) / 1000 for p in PERCENTILES} | {'max': histogram.max() / 1000},
+        'max_sender_lag_ms': max(result['max_lag'] for result in results) * 1000,
+        'next_id': first_id + options.processes * ids_per_process,
+    }
+
+def report(endpoint: str, result: dict) -> None:
+    latency = result['latency_ms']
+    errors = sum(count for outcome, count in result['statuses'].items() if not outcome.startswith('2'))
+    print(f'{endpoint} at {result["target_rate"]:,.0f} requests/s: achieved {result["achieved_rate"]:,.0f}/s, '
+          f'{errors} errors {result["statuses"]}')
+    print('  latency ms ' + '  '.join(f'p{p}={latency[str(p)]:.2f}' for p in PERCENTILES) + f'  max={latency["max"]:.2f}')
+    if result['max_sender_lag_ms'] > 10:
+        print(f'  warning: generator fell {result["max_sender_lag_ms"]:.0f} ms behind schedule, add --processes to trust this rate')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Open loop load generator with latency measured from each request\'s scheduled send time')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='API base URL (default: http://127.0.0.1:8000)')
+    parser.add_argument('--endpoint', choices=ENDPOINTS, default='fast', help='endpoint to load (default: fast)')
+    parser.add_argument('--rate', default='1000', help='target requests per second, a comma separated list steps through each rate (default: 1000)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per rate (default: 30)')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help='generator processes (default: one per CPU)')
+    parser.add_argument('--connections', type=int, default=100, help='HTTP connections per process (default: 100)')
+    parser.add_argument('--batch-size', type=int, default=100, help='readings per /readings/fast/batch request (default: 100)')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a request counts as timed out (default: 10)')
+    parser.add_argument('--first-id', type=int, default=time_ns() // 1000, help='first reading id, ranges are split between processes (default: derived from the current time)')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    options = parser.parse_args()
+
+    results = []
+    next_id = options.first_id
+    for rate in (float(rate) for rate in options.rate.split(',')):
+        result = run_rate(options, rate, next_id)
+        next_id = result.pop('next_id') # later rates continue after the ids already sent
+        report(options.endpoint, result)
+        results.append(result)
+
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            json.dump({'endpoint': options.endpoint, 'duration': options.duration, 'processes': options.processes, 'results': results}, file, indent=2)
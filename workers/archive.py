@@ -0,0 +1,146 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from time import monotonic
+from typing import BinaryIO, Literal
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from workers.sinks import Sink
+
+logger = logging.getLogger('iot-firehose-logger')
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('reading', pa.int16()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+])
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+TMP_SUFFIX = '.tmp' # files still being written, never read these
+
+def to_table(batch: np.ndarray) -> pa.Table:
+    """Converts a decoded batch (schemas.wire.WIRE_DTYPE) to an Arrow table, the timestamps are already unix microseconds"""
+    return pa.table([
+        pa.array(np.ascontiguousarray(batch['id'])),
+        pa.array(np.ascontiguousarray(batch['reading'])),
+        pa.array(np.ascontiguousarray(batch['timestamp']), type=SCHEMA.field('timestamp').type),
+    ], schema=SCHEMA)
+
+class ArchiveSink(Sink):
+    """
+    Columnar archive of readings in DIRECTORY, as Parquet (zstd) or Arrow IPC files
+    Batches are gathered into row groups of ROW_GROUP rows. A file is committed once it holds MAX_ROWS rows or its
+    first batch is MAX_AGE seconds old: written as <name>.tmp, fsynced, then atomically renamed, so a reader only ever
+    sees complete files. The Redis ids of a file's rows are reported durable only after the rename
+    Keep MAX_AGE below CLAIM_MIN_IDLE, entries waiting for their file stay pending and would otherwise be reclaimed
+    """
+    def __init__(self, directory: str, consumer: str, format: Literal['parquet', 'arrow'], row_group: int,
+                 max_rows: int, max_age: float) -> None:
+        self.directory = directory
+        self.consumer = consumer
+        self.format = format
+        self.row_group = row_group
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.lock = asyncio.Lock() # concurrent flushers (PIPELINE_FLUSHERS) share one open file
+
+        self.pending: list[np.ndarray] = [] # batches not yet written out as a row group
+        self.pending_rows: int = 0
+        self.rows: int = 0 # rows already written to the open file
+        self.redis_ids: list = [] # ids of every row in the open file, pending or written
+        self.opened: float | None = None # monotonic time of the open file's first batch
+        self.file: BinaryIO | None = None
+        self.writer: pq.ParquetWriter | ipc.RecordBatchFileWriter | None = None
+        self.path: str = ''
+
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory): # left behind by a crash, their entries were never acknowledged and will be re-read
+            if name.endswith(TMP_SUFFIX) and f'-{consumer}.' in name:
+                os.remove(os.path.join(directory, name))
+                logger.warning(f'Removed incomplete archive file {name}')
+
+    async def write(self, redis_ids: list, data: list, batch: np.ndarray | None) -> list:
+        """
+        Adds the batch to the open file, returns the ids of the file if this batch completed it
+        """
+        async with self.lock:
+            self.pending.append(batch) # type: ignore
+            self.pending_rows += len(batch) # type: ignore
+            self.redis_ids.extend(redis_ids)
+            if self.opened is None:
+                self.opened = monotonic()
+            if self.rows + self.pending_rows >= self.max_rows or monotonic() - self.opened >= self.max_age:
+                return await self._commit()
+            if self.pending_rows >= self.row_group:
+                await asyncio.to_thread(self._write_row_group)
+            return []
+
+    async def roll(self) -> list:
+        """
+        Commits the open file once it is MAX_AGE seconds old, even if no new batches arrive
+        """
+        async with self.lock:
+            if self.opened is not None and monotonic() - self.opened >= self.max_age:
+                return await self._commit()
+            return []
+
+    async def close(self) -> list:
+        """Commits whatever is open"""
+        async with self.lock:
+            return await self._commit() if self.redis_ids else []
+
+    async def _commit(self) -> list:
+        """
+        Writes the remaining rows, commits the file and returns the ids it holds
+        """
+        await asyncio.to_thread(self._finish)
+        redis_ids, self.redis_ids = self.redis_ids, []
+        self.rows = 0
+        self.opened = None
+        return redis_ids
+
+    def _write_row_group(self) -> None:
+        """
+        Writes the pending batches as one row group, opening the next file if needed (runs in a thread)
+        """
+        if self.writer is None:
+            name = f'readings-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{self.consumer}.{EXTENSIONS[self.format]}'
+            self.path = os.path.join(self.directory, name)
+            self.file = open(self.path + TMP_SUFFIX, 'wb')
+            if self.format == 'parquet':
+                self.writer = pq.ParquetWriter(self.file, SCHEMA, compression='zstd')
+            else:
+                self.writer = ipc.new_file(self.file, SCHEMA)
+        table = to_table(np.concatenate(self.pending))
+        if self.format == 'parquet':
+            self.writer.write_table(table, row_group_size=len(table)) # type: ignore
+        else:
+            self.writer.write_table(table) # type: ignore
+        self.rows += len(table)
+        self.pending = []
+        self.pending_rows = 0
+
+    def _finish(self) -> None:
+        """
+        Closes the open file, fsyncs it and renames it into place, then fsyncs the directory so the rename survives a crash
+        (runs in a thread)
+        """
+        if self.pending:
+            self._write_row_group()
+        self.writer.close() # type: ignore
+        self.file.flush() # type: ignore
+        os.fsync(self.file.fileno()) # type: ignore
+        self.file.close() # type: ignore
+        os.replace(self.path + TMP_SUFFIX, self.path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        logger.info(f'Archived {self.rows} readings to {self.path}')
+        self.writer = None
+        self.file = None
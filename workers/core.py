@@ -0,0 +1,397 @@
+import signal
+import asyncio
+import logging
+from time import monotonic
+from typing import Awaitable, Callable
+
+import numpy as np
+from redis import exceptions
+from asyncpg import Pool, Connection
+
+from config.redis_config import redis_client, redis_binary_client
+from config.config import settings
+from config.log import setup_logger
+from config.database_config import create_staging_table, insert_from_staging
+from config.partitions import maintain_partitions, partition_maintenance
+from schemas.wire import text_records, binary_records, decode_entries
+from schemas.pg_copy import encode_copy
+from config import metrics, tracing
+from config.tracing import tracer
+from workers.flush_controller import FlushController
+from workers.rollup import insert_from_staging_with_rollups
+
+running: bool = True # flag to shut down worker after FastAPI shutdown
+
+def signal_shutdown(_sig, _frame) -> None:
+    """
+    Stops the drain loop
+    _sig and _frame are required by the signal module
+    """
+    global running
+    running = False
+
+signal.signal(signal.SIGINT, signal_shutdown) # Catch CTRL+C
+signal.signal(signal.SIGTERM, signal_shutdown) # Catch kill command
+
+logger: logging.Logger = setup_logger(settings.VERBOSE, settings.CLEAR_LOG)
+
+stream_client = redis_binary_client if settings.WIRE_FORMAT == 'binary' else redis_client # binary entries must be read back as raw bytes
+
+recovered_own_pel: bool = False # entries delivered to this consumer name before a crash are re-read once at startup
+next_claim: float = 0 # monotonic time of the next XAUTOCLAIM pass
+claim_cursor: str = '0-0' # XAUTOCLAIM resumes from here so each pass only scans one page of the PEL
+next_trim: float = 0 # monotonic time of the next trim of acknowledged entries
+
+controller = FlushController(settings.ADAPTIVE_FLUSH, settings.BUFFER, settings.BUFFER_TIME,
+                             settings.FLUSH_LATENCY_SLO, settings.FLUSH_MAX_BATCH) # decides when the buffer is flushed, see snapshot() for its current decisions
+
+Flush = Callable[[Pool, list, list], Awaitable[None]] # flush(pool, redis_ids, data) copies one batch into Postgres and acknowledges it
+
+def check_stream_layout() -> None:
+    """
+    Refuses to start a worker on the unsharded STREAM_NAME when SHARD_COUNT > 1: producers only write to the shard streams,
+    so it would wait on a stream nothing is written to. Run sharded workers through workers.fleet, or set STREAM_NAME
+    to one shard (e.g. db_buffer:0). A drain only worker may still empty the base stream of an old unsharded layout
+    """
+    shard = settings.STREAM_NAME.rpartition(':')[2]
+    if settings.SHARD_COUNT > 1 and not settings.DRAIN_ONLY and not shard.isdigit():
+        message = (f'SHARD_COUNT is {settings.SHARD_COUNT} but this worker would read {settings.STREAM_NAME}, '
+                   f'which producers no longer write to. Start workers with python -m workers.fleet or set STREAM_NAME to a shard')
+        logger.error(message)
+        raise SystemExit(message)
+
+async def ensure_consumer_group() -> None:
+    """
+    Checks the worker reads a stream producers write to (see check_stream_layout)
+    Creates the consumer group (and the stream) if it does not already exist
+    """
+    check_stream_layout()
+    try:
+        await redis_client.xgroup_create(settings.STREAM_NAME, settings.CONSUMER_GROUP, id='0', mkstream=True)
+    except exceptions.ResponseError as e:
+        if "Consumer Group name already exists" not in str(e): # if the exception doesn't have to do with the consumer group already existing, raise
+            raise
+
+async def read_entries(redis_ids: list, data: list, block: int = 5000) -> None:
+    """
+    Read from Redis stream
+    Returns a maximum of 1000 requests at a time
+    Waits up to BLOCK milliseconds (default 5 seconds) if no messages have been added to the stream
+    Appends redis ids (for acknowledgement) and payloads (for processing) to the buffers
+    On the first call, re-reads this consumer's own pending entries, e.g. after the fleet restarted a crashed process
+    Every CLAIM_INTERVAL seconds, also claims entries other consumers left pending for over CLAIM_MIN_IDLE seconds
+    Redelivered entries that keep failing are dead lettered instead of buffered (see dead_letter_redelivered)
+    """
+    global recovered_own_pel, next_claim
+    if not recovered_own_pel:
+        recovered_own_pel = True
+        before = len(redis_ids)
+        await read_group(redis_ids, data, '0') # '0' returns entries already delivered to this consumer but never acknowledged
+        await dead_letter_redelivered(redis_ids, data, before)
+    if monotonic() >= next_claim:
+        next_claim = monotonic() + settings.CLAIM_INTERVAL
+        await claim_idle_entries(redis_ids, data)
+
+    await read_group(redis_ids, data, '>', block) # '>' means worker only reads from latest messages in the stream and adds to PEL util xack
+
+async def read_group(redis_ids: list, data: list, start: str, block: int = 5000) -> None:
+    """
+    One XREADGROUP call from START, see read_entries
+    """
+    traced = tracer.sample()
+    if traced:
+        tracer.record(tracing.READ, 1000)
+    readings = await stream_client.xreadgroup(settings.CONSUMER_GROUP,
+                                    settings.CONSUMER_NAME,
+                                    {settings.STREAM_NAME: start},
+                                    count=1000, # read up to 1000 messages at a time
+                                    block=block) # worker will wait for messages for up to BLOCK milliseconds before returning empty (ignored for '0')
+    for _, messages in readings or []: # type: ignore
+        for message_id, payload in messages:
+            if payload: # entries deleted from the stream while still pending come back without a payload
+                redis_ids.append(message_id)
+                data.append(payload)
+    if traced:
+        tracer.record(tracing.READ_DONE, sum(len(messages) for _, messages in readings or [])) # type: ignore
+
+async def claim_idle_entries(redis_ids: list, data: list) -> None:
+    """
+    Takes over entries that have been pending for longer than CLAIM_MIN_IDLE seconds, e.g. because their consumer died mid batch
+    Claimed entries join the current buffer, so they are copied and acknowledged like any other entry (at least once delivery)
+    """
+    global claim_cursor
+    before = len(redis_ids)
+    result = await stream_client.xautoclaim(settings.STREAM_NAME, settings.CONSUMER_GROUP, settings.CONSUMER_NAME,
+                                    min_idle_time=int(settings.CLAIM_MIN_IDLE * 1000),
+                                    start_id=claim_cursor,
+                                    count=1000)
+    next_id, messages = result[0], result[1]
+    claim_cursor = next_id.decode() if isinstance(next_id, bytes) else next_id # '0-0' once the whole PEL has been scanned
+
+    claimed = 0
+    for message_id, payload in messages:
+        if payload:
+            redis_ids.append(message_id)
+            data.append(payload)
+            claimed += 1
+    if claimed:
+        logger.info(f'Consumer {settings.CONSUMER_NAME} claimed {claimed} idle pending entries')
+        await dead_letter_redelivered(redis_ids, data, before)
+
+async def dead_letter_redelivered(redis_ids: list, data: list, start: int) -> None:
+    """
+    Checks the delivery counts of the entries buffered from index START on, which were just redelivered (own PEL or XAUTOCLAIM)
+    An entry delivered more than MAX_DELIVERIES times keeps failing every worker that reads it (e.g. a value the COPY rejects),
+    so it is moved to DEAD_LETTER_STREAM with its source stream and entry id and acknowledged instead of being buffered again
+    Entries of a failing batch share its delivery count, so the rest of that batch goes with it and can be replayed from there
+    """
+    if settings.MAX_DELIVERIES <= 0 or len(redis_ids) == start:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe: # one round trip, only on the recovery and claim paths
+        for redis_id in redis_ids[start:]:
+            pipe.xpending_range(settings.STREAM_NAME, settings.CONSUMER_GROUP, min=redis_id, max=redis_id, count=1)
+        pending = await pipe.execute()
+
+    keep_ids, keep_data, dead = [], [], []
+    for redis_id, payload, entry in zip(redis_ids[start:], data[start:], pending):
+        if entry and entry[0]['times_delivered'] > settings.MAX_DELIVERIES:
+            dead.append((redis_id, payload))
+        else:
+            keep_ids.append(redis_id)
+            keep_data.append(payload)
+    if not dead:
+        return
+
+    async with stream_client.pipeline(transaction=True) as pipe: # moved and acknowledged together, so no entry is lost or kept twice
+        for redis_id, payload in dead:
+            pipe.xadd(settings.DEAD_LETTER_STREAM, {**payload, 'source': settings.STREAM_NAME, 'entry': redis_id})
+        pipe.xack(settings.STREAM_NAME, settings.CONSUMER_GROUP, *(redis_id for redis_id, _ in dead))
+        await pipe.execute()
+    redis_ids[start:] = keep_ids
+    data[start:] = keep_data
+    metrics.dead_lettered.inc(settings.STREAM_NAME, amount=len(dead))
+    logger.error(f'Moved {len(dead)} entries delivered more than {settings.MAX_DELIVERIES} times from {settings.STREAM_NAME} '
+                 f'to {settings.DEAD_LETTER_STREAM}, from entry {dead[0][0]} to {dead[-1][0]}')
+
+def parse_stream_id(stream_id: str) -> tuple[int, int]:
+    """
+    Splits a stream entry ID like 1656416957625-0 into (milliseconds, sequence) so IDs compare correctly
+    """
+    milliseconds, _, sequence = stream_id.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+async def trim_acknowledged() -> None:
+    """
+    XACK never deletes entries, so trims the stream (XTRIM MINID) below the oldest entry any consumer group still needs:
+    its oldest pending entry, or its last delivered entry if nothing is pending (everything before it was acknowledged)
+    Approximate trimming only drops whole internal nodes, which is much cheaper and never goes past MINID
+    """
+    floor = None
+    for group in await redis_client.xinfo_groups(settings.STREAM_NAME):
+        if group['pending']:
+            keep = (await redis_client.xpending(settings.STREAM_NAME, group['name']))['min']
+        else:
+            keep = group['last-delivered-id']
+        if floor is None or parse_stream_id(keep) < parse_stream_id(floor):
+            floor = keep
+
+    if floor is not None and floor != '0-0':
+        trimmed = await redis_client.xtrim(settings.STREAM_NAME, minid=floor, approximate=True)
+        logger.debug(f'Trimmed {trimmed} acknowledged entries below {floor} from {settings.STREAM_NAME}')
+
+def build_records(data: list, include_id: bool = True) -> list[tuple]:
+    """
+    Converts a batch of stream entries into the tuples copy_records_to_table expects
+    In WIRE_FORMAT binary mode, decodes the whole batch at once
+    include_id=False drops the id column, it is not needed for readings2 since it uses an identity column
+    """
+    if settings.WIRE_FORMAT == 'binary':
+        return binary_records(data, include_id)
+    return text_records(data, include_id)
+
+async def copy_batch(conn: Connection, table: str, data: list, include_id: bool = True, into: str | None = None,
+                     batch: np.ndarray | None = None) -> None:
+    """
+    Bulk copies a batch of stream entries into TABLE with PostgreSQL's COPY protocol, which is faster than individual inserts
+    Tables listed in BINARY_COPY_TABLES skip per record tuples and datetimes: the batch is decoded into columns
+    and encoded straight into a binary COPY buffer (see schemas/pg_copy.py)
+    WIRE_FORMAT binary always takes that path, building a datetime per record from binary entries is slower than parsing text
+    INTO copies into another table shaped like TABLE instead (e.g. its staging table), using TABLE's COPY mode
+    BATCH is the already decoded batch if the caller has one, so the binary path doesn't decode twice
+    """
+    columns = ('id', 'reading', 'timestamp') if include_id else ('reading', 'timestamp')
+    if table in settings.BINARY_COPY_TABLES or settings.WIRE_FORMAT == 'binary':
+        if batch is None:
+            batch = decode_entries(data, settings.WIRE_FORMAT == 'binary')
+        await conn.copy_to_table(into or table, source=encode_copy(batch, include_id), columns=columns, format='binary')
+    else:
+        await conn.copy_records_to_table(into or table, records=build_records(data, include_id), columns=columns)
+
+async def copy_batch_skip_duplicates(conn: Connection, table: str, data: list, batch: np.ndarray | None = None,
+                                     rollups: bool = False, include_id: bool = True) -> int:
+    """
+    Conflict tolerant version of copy_batch: COPY into a temporary staging table, then INSERT ... SELECT ... ON CONFLICT DO NOTHING
+    Keeps COPY level throughput when the batch contains ids that already exist, instead of failing the whole batch
+    With ROLLUPS, the rows that were kept are also folded into readings_1m in the same statement
+    include_id=False leaves the id to TABLE's identity column (readings2), as in copy_batch
+    Must run inside a transaction, returns the number of rows kept
+    """
+    staging = await create_staging_table(conn, table)
+    await copy_batch(conn, table, data, include_id, into=staging, batch=batch)
+    if rollups:
+        return await insert_from_staging_with_rollups(conn, table, staging)
+    return await insert_from_staging(conn, table, staging, ('id', 'reading', 'timestamp') if include_id else ('reading', 'timestamp'))
+
+async def stream_drained() -> bool:
+    """
+    True once every entry of the stream has been delivered and acknowledged (DRAIN_ONLY mode)
+    Only called after a read came back empty, so the XPENDING check is off the hot path
+    """
+    pending = await redis_client.xpending(settings.STREAM_NAME, settings.CONSUMER_GROUP)
+    return not pending['pending']
+
+async def drain(pool: Pool, flush: Flush) -> None:
+    """
+    Reads the stream until shutdown (or until it is empty in DRAIN_ONLY mode) and hands each full buffer to flush
+    The flush controller decides when a buffer is full, either from BUFFER/BUFFER_TIME or adaptively (ADAPTIVE_FLUSH)
+    With PIPELINE_FLUSHERS > 0 the next buffer is read while earlier ones are still being copied
+    With PARTITIONING, creates upcoming partitions before the first COPY and keeps maintaining them in the background
+    With METRICS, serves Prometheus metrics on METRICS_PORT
+    With TRACE_SAMPLE_RATE > 0, dumps sampled traces on SIGUSR1, every TRACE_DUMP_INTERVAL seconds and on shutdown
+    Flushes whatever is left in the buffer on shutdown
+    """
+    server = await start_metrics_server() if settings.METRICS and settings.METRICS_PORT else None
+    trace_dumps = tracing.start_tracing()
+    maintenance = None
+    if settings.PARTITIONING:
+        partitioning = (settings.PARTITION_INTERVAL, settings.PARTITION_PREMAKE, settings.PARTITION_RETENTION)
+        await maintain_partitions(pool, *partitioning)
+        maintenance = asyncio.create_task(partition_maintenance(pool, *partitioning, settings.PARTITION_MAINTENANCE_INTERVAL))
+
+    try:
+        if settings.PIPELINE_FLUSHERS > 0:
+            await drain_pipelined(pool, flush, settings.PIPELINE_FLUSHERS, settings.PIPELINE_MAX_IN_FLIGHT)
+        else:
+            await drain_serial(pool, flush)
+    finally:
+        if maintenance is not None:
+            maintenance.cancel()
+        if server is not None:
+            server.close()
+        await tracing.stop_tracing(trace_dumps)
+
+    if settings.CLEAR_STREAM:
+        await redis_client.delete(settings.STREAM_NAME) # delete the stream key if set in config
+
+async def collect_stream_state() -> None:
+    """
+    Metrics collector: consumer group lag and PEL size of this worker's stream, read from XINFO GROUPS when scraped
+    """
+    for group in await redis_client.xinfo_groups(settings.STREAM_NAME):
+        if group['name'] == settings.CONSUMER_GROUP:
+            if group.get('lag') is not None: # None when Redis cannot tell (e.g. after XDEL)
+                metrics.consumer_lag.set(group['lag'], settings.STREAM_NAME)
+            metrics.pending_entries.set(group['pending'], settings.STREAM_NAME)
+
+async def collect_flush_state() -> None:
+    """
+    Metrics collector: the flush controller's current target batch, max wait and measured arrival rate
+    """
+    state = controller.snapshot()
+    metrics.flush_target_batch.set(state['target_batch'])
+    metrics.flush_max_wait_seconds.set(state['max_wait'])
+    metrics.arrival_rate.set(state['arrival_rate'])
+
+async def start_metrics_server() -> asyncio.Server | None:
+    """
+    Serves /metrics on METRICS_HOST:METRICS_PORT, a port that is already taken only disables metrics for this worker
+    """
+    metrics.collectors.append(collect_stream_state)
+    metrics.collectors.append(collect_flush_state)
+    try:
+        return await metrics.serve_metrics(settings.METRICS_HOST, settings.METRICS_PORT)
+    except OSError as e:
+        logger.error(f'Could not serve metrics on {settings.METRICS_HOST}:{settings.METRICS_PORT}: {e}')
+        return None
+
+async def timed_flush(pool: Pool, flush: Flush, redis_ids: list, data: list) -> None:
+    """
+    Runs flush and reports its duration to the flush controller
+    """
+    start = monotonic()
+    await flush(pool, redis_ids, data)
+    elapsed = monotonic() - start
+    controller.copied(len(redis_ids), elapsed)
+    metrics.flush_seconds.observe(elapsed)
+    metrics.flush_batch_size.observe(len(redis_ids))
+    if logger.isEnabledFor(logging.DEBUG): # snapshot() and the f-string would otherwise cost every flush with VERBOSE off
+        logger.debug(f'Flush controller state {controller.snapshot()}')
+
+async def fill_buffer(redis_ids: list, data: list) -> None:
+    """
+    Reads once into the buffers, blocking no longer than the time left before the buffer is due
+    so a buffered batch is flushed on time even when no new entries arrive
+    """
+    global next_trim
+    before = len(redis_ids)
+    await read_entries(redis_ids, data, controller.block_ms())
+    controller.arrived(len(redis_ids) - before)
+
+    if settings.TRIM_INTERVAL > 0 and monotonic() >= next_trim:
+        next_trim = monotonic() + settings.TRIM_INTERVAL
+        await trim_acknowledged()
+
+async def drain_serial(pool: Pool, flush: Flush) -> None:
+    """
+    Read, COPY, XACK, then read again
+    """
+    # create buffers
+    redis_ids = [] # capture Redis auto generated IDs, e.g. 1656416957625-0.
+    data = [] # capture data from each payload
+
+    while running: # worker loop
+        await fill_buffer(redis_ids, data)
+        if settings.DRAIN_ONLY and not redis_ids and await stream_drained():
+            break
+
+        if controller.should_flush(): # clears the buffer when the batch is big enough or its oldest entry has waited long enough
+            batch_ids, batch_data = redis_ids, data
+            redis_ids, data = [], [] # hand the buffers to flush and start new ones
+            controller.flushed() # restart the timer
+            await timed_flush(pool, flush, batch_ids, batch_data)
+
+    if redis_ids:
+        await timed_flush(pool, flush, redis_ids, data)
+
+async def drain_pipelined(pool: Pool, flush: Flush, flushers: int, max_in_flight: int) -> None:
+    """
+    A reader task keeps filling buffers while up to FLUSHERS tasks run COPY + XACK concurrently on separate pool connections
+    Full buffers wait in a queue of at most MAX_IN_FLIGHT batches, when it is full the reader blocks (backpressure)
+    Any flush failure cancels the other tasks and is raised, the same as in serial mode
+    """
+    queue: asyncio.Queue[tuple[list, list] | None] = asyncio.Queue(maxsize=max_in_flight)
+
+    async def reader() -> None:
+        redis_ids = []
+        data = []
+        while running:
+            await fill_buffer(redis_ids, data)
+            if settings.DRAIN_ONLY and not redis_ids and await stream_drained(): # batches still being flushed keep the PEL non empty
+                break
+            if controller.should_flush():
+                controller.flushed()
+                await queue.put((redis_ids, data)) # blocks while MAX_IN_FLIGHT batches are already waiting
+                redis_ids, data = [], []
+        if redis_ids:
+            await queue.put((redis_ids, data))
+        for _ in range(flushers):
+            await queue.put(None) # one stop sentinel per flusher, queued behind the remaining batches
+
+    async def flusher() -> None:
+        while (batch := await queue.get()) is not None:
+            await timed_flush(pool, flush, *batch)
+
+    async with asyncio.TaskGroup() as group:
+        group.create_task(reader())
+        for _ in range(flushers):
+            group.create_task(flusher())
@@ -0,0 +1,108 @@
+import argparse
+import importlib
+import asyncio
+import signal
+import multiprocessing
+from multiprocessing.process import BaseProcess
+from time import sleep
+
+WORKERS = ('worker', 'process_safe_worker') # modules in the workers package that define save_to_db()
+
+def run_worker(module: str, consumer_name: str, stream: str, drain_only: bool, index: int, shard_count: int) -> None:
+    """
+    Entry point of each fleet process
+    Overrides CONSUMER_NAME and STREAM_NAME before the worker starts so every process is a separate consumer
+    of its own stream (shard) in the shared group
+    SHARD_COUNT becomes the shard count the fleet was planned for, which may differ from the environment's during a resize
+    Process INDEX serves its metrics on METRICS_PORT + INDEX
+    """
+    from config.config import settings
+    settings.CONSUMER_NAME = consumer_name
+    settings.STREAM_NAME = stream
+    settings.DRAIN_ONLY = drain_only
+    settings.SHARD_COUNT = shard_count
+    if settings.METRICS_PORT:
+        settings.METRICS_PORT += index
+    worker = importlib.import_module(f'workers.{module}')
+    asyncio.run(worker.save_to_db())
+
+def plan(procs: int, shard_count: int, drain_shard_count: int | None) -> list[tuple[str, str, bool]]:
+    """
+    Returns (consumer name, stream, drain only) for every process
+    Unsharded: PROCS consumers share STREAM_NAME
+    Sharded: exactly one consumer per shard, so readings of one device are copied in the order they were written
+    Streams of the old layout (DRAIN_SHARD_COUNT) that the new layout no longer uses get a drain only consumer
+    """
+    from config.config import settings
+    from config.sharding import stream_layout
+
+    streams = stream_layout(shard_count)
+    if shard_count <= 1:
+        consumers = [(f'{settings.CONSUMER_NAME}-{i}', streams[0], False) for i in range(procs)]
+    else:
+        consumers = [(f'{settings.CONSUMER_NAME}-{stream}', stream, False) for stream in streams]
+
+    if drain_shard_count is not None:
+        consumers += [(f'{settings.CONSUMER_NAME}-{stream}', stream, True)
+                      for stream in stream_layout(drain_shard_count) if stream not in streams]
+    return consumers
+
+def supervise(module: str, consumers: list[tuple[str, str, bool]], shard_count: int) -> None:
+    """
+    Starts one worker process per consumer, all sharing CONSUMER_GROUP, for a layout of SHARD_COUNT shards
+    Restarts any process that dies under the same consumer name, so it re-reads the entries it left pending
+    Entries pending on a consumer that does not come back are claimed by the others after CLAIM_MIN_IDLE seconds
+    Drain only consumers are not restarted once they exit cleanly, their stream is empty and can be deleted
+    Forwards CTRL+C/kill to the workers and waits for them to flush and exit
+    """
+    context = multiprocessing.get_context('spawn') # fresh interpreter per worker, nothing (event loop, redis connections) is shared with the supervisor
+    processes: dict[str, BaseProcess] = {}
+    retired: set[str] = set()
+    stopping = False
+
+    def start(name: str, stream: str, drain_only: bool, index: int) -> None:
+        process = context.Process(target=run_worker, args=(module, name, stream, drain_only, index, shard_count), name=name)
+        process.start()
+        processes[name] = process
+
+    def stop(_sig, _frame) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop) # Catch CTRL+C
+    signal.signal(signal.SIGTERM, stop) # Catch kill command
+
+    for index, (name, stream, drain_only) in enumerate(consumers):
+        start(name, stream, drain_only, index)
+        print(f'Started {module} consumer {name} on {stream}{" (drain only)" if drain_only else ""}')
+
+    while not stopping:
+        sleep(1)
+        for index, (name, stream, drain_only) in enumerate(consumers):
+            process = processes[name]
+            if process.is_alive() or stopping or name in retired:
+                continue
+            if drain_only and process.exitcode == 0:
+                print(f'Consumer {name} finished draining {stream}')
+                retired.add(name)
+            else:
+                print(f'Consumer {name} exited with code {process.exitcode}, restarting')
+                start(name, stream, drain_only, index)
+
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate() # SIGTERM lets the worker finish its current flush
+    for process in processes.values():
+        process.join()
+    print('Shutting down fleet')
+
+if __name__ == '__main__':
+    from config.config import settings
+
+    parser = argparse.ArgumentParser(description='Runs several worker processes as one consumer group')
+    parser.add_argument('--procs', type=int, default=multiprocessing.cpu_count(), help='number of worker processes when unsharded (default: CPU count)')
+    parser.add_argument('--worker', choices=WORKERS, default='worker', help='which worker to run (default: worker)')
+    parser.add_argument('--shards', type=int, default=settings.SHARD_COUNT, help='shard count producers write with, one process per shard (default: SHARD_COUNT)')
+    parser.add_argument('--drain-shards', type=int, default=None, help='previous shard count while resizing, its leftover streams are drained then retired')
+    args = parser.parse_args()
+    supervise(args.worker, plan(args.procs, args.shards, args.drain_shards), args.shards)
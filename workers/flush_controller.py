@@ -0,0 +1,135 @@
+from math import exp
+from time import monotonic
+
+class FlushController:
+    """
+    Decides when the worker flushes its buffer, on a monotonic clock
+
+    Static mode keeps the old behaviour: flush once more than BUFFER entries are buffered or the oldest buffered
+    entry has waited BUFFER_TIME seconds
+    Adaptive mode sizes both from measurements instead:
+    - arrival rate, an exponentially weighted moving average of entries read per second
+    - COPY cost, fitted online as overhead + per_row * rows from recent flush durations
+    An entry's latency is roughly its wait in the buffer plus the COPY that writes it, so the controller picks the
+    longest wait w with w + overhead + per_row * (rate * w) <= LATENCY_SLO and targets a batch of rate * w rows,
+    capped at MAX_BATCH. Low traffic gets short waits, high traffic gets large batches that amortize the COPY
+    """
+    RATE_HALF_LIFE: float = 1.0 # seconds for old arrival rate measurements to lose half their weight
+    COPY_DECAY: float = 0.9 # weight kept by older COPY measurements each time a new flush is recorded
+
+    def __init__(self, adaptive: bool, buffer: int, buffer_time: float, latency_slo: float, max_batch: int) -> None:
+        self.adaptive = adaptive
+        self.buffer = buffer
+        self.buffer_time = buffer_time
+        self.latency_slo = latency_slo
+        self.max_batch = max_batch
+
+        self.buffered: int = 0 # entries read since the last flush
+        self.oldest: float | None = None # monotonic time the oldest buffered entry was read
+        self.arrival_rate: float = 0.0 # entries per second
+        self.last_arrival: float = monotonic()
+
+        # exponentially weighted sums for the least squares fit of COPY seconds against rows
+        self.copy_weight: float = 0.0
+        self.sum_rows: float = 0.0
+        self.sum_seconds: float = 0.0
+        self.sum_rows_sq: float = 0.0
+        self.sum_rows_seconds: float = 0.0
+
+        self.target_batch: int = buffer
+        self.max_wait: float = buffer_time
+
+    def arrived(self, count: int) -> None:
+        """
+        Records entries added to the buffer by one read, including reads that returned nothing
+        """
+        now = monotonic()
+        elapsed = now - self.last_arrival
+        self.last_arrival = now
+        if elapsed > 0:
+            decay = exp(-elapsed * 0.6931471805599453 / self.RATE_HALF_LIFE) # ln(2) / half life
+            self.arrival_rate = decay * self.arrival_rate + (1 - decay) * (count / elapsed)
+        if count and not self.buffered:
+            self.oldest = now
+        self.buffered += count
+        if self.adaptive:
+            self._plan()
+
+    def flushed(self) -> None:
+        """
+        Records that the buffer was handed to a flush, restarting the wait timer
+        """
+        self.buffered = 0
+        self.oldest = None
+
+    def copied(self, rows: int, seconds: float) -> None:
+        """
+        Records how long a COPY of ROWS rows took, feeding the COPY cost fit
+        """
+        decay = self.COPY_DECAY
+        self.copy_weight = decay * self.copy_weight + 1
+        self.sum_rows = decay * self.sum_rows + rows
+        self.sum_seconds = decay * self.sum_seconds + seconds
+        self.sum_rows_sq = decay * self.sum_rows_sq + rows * rows
+        self.sum_rows_seconds = decay * self.sum_rows_seconds + rows * seconds
+
+    def copy_cost(self) -> tuple[float, float]:
+        """
+        Returns the fitted (overhead seconds, seconds per row) of a COPY
+        Falls back to a pure per row cost until flushes of different sizes have been seen
+        """
+        if not self.copy_weight or not self.sum_rows:
+            return 0.0, 0.0
+        mean_rows = self.sum_rows / self.copy_weight
+        mean_seconds = self.sum_seconds / self.copy_weight
+        variance = self.sum_rows_sq / self.copy_weight - mean_rows * mean_rows
+        if variance > 1e-9 * mean_rows * mean_rows:
+            per_row = (self.sum_rows_seconds / self.copy_weight - mean_rows * mean_seconds) / variance
+            overhead = mean_seconds - per_row * mean_rows
+            if per_row > 0 and overhead >= 0:
+                return overhead, per_row
+        return 0.0, mean_seconds / mean_rows
+
+    def _plan(self) -> None:
+        """
+        Recomputes target_batch and max_wait from the current measurements (adaptive mode only)
+        """
+        overhead, per_row = self.copy_cost()
+        budget = max(self.latency_slo - overhead, 0.0)
+        self.max_wait = budget / (1 + self.arrival_rate * per_row)
+        self.target_batch = max(1, min(self.max_batch, int(self.arrival_rate * self.max_wait)))
+
+    def should_flush(self) -> bool:
+        """
+        True once the buffer holds the target batch or its oldest entry has waited max_wait seconds
+        """
+        if not self.buffered:
+            return False
+        if self.adaptive:
+            return self.buffered >= self.target_batch or monotonic() - self.oldest >= self.max_wait # type: ignore
+        return self.buffered > self.buffer or monotonic() - self.oldest >= self.buffer_time # type: ignore
+
+    def block_ms(self, limit: int = 5000) -> int:
+        """
+        How long the next XREADGROUP may block, so a buffered batch is flushed on time even if no new entries arrive
+        """
+        if not self.buffered:
+            return limit
+        remaining = self.oldest + (self.max_wait if self.adaptive else self.buffer_time) - monotonic() # type: ignore
+        return max(1, min(limit, int(remaining * 1000))) # 0 would mean block forever
+
+    def snapshot(self) -> dict:
+        """
+        Current measurements and decisions, for logging and inspection
+        """
+        overhead, per_row = self.copy_cost()
+        return {
+            'adaptive': self.adaptive,
+            'arrival_rate': self.arrival_rate,
+            'copy_overhead': overhead,
+            'copy_per_row': per_row,
+            'target_batch': self.target_batch if self.adaptive else self.buffer,
+            'max_wait': self.max_wait if self.adaptive else self.buffer_time,
+            'buffered': self.buffered,
+            'oldest_age': monotonic() - self.oldest if self.oldest is not None else 0.0,
+        }
@@ -0,0 +1,94 @@
+import numpy as np
+from asyncpg import Connection
+
+ROLLUP_TABLE = 'readings_1m'
+BUCKET_US = 60 * 1_000_000 # one minute in microseconds
+
+CREATE_ROLLUP_TABLE = f'''
+    CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+        id bigint NOT NULL,
+        bucket timestamptz NOT NULL,
+        count bigint NOT NULL,
+        sum bigint NOT NULL,
+        min smallint NOT NULL,
+        max smallint NOT NULL,
+        PRIMARY KEY (id, bucket)
+    )
+'''
+
+# folds new accumulators into existing ones, a minute that spans several batches keeps adding up
+MERGE_ROLLUPS = f'''
+    ON CONFLICT (id, bucket) DO UPDATE SET
+        count = {ROLLUP_TABLE}.count + excluded.count,
+        sum = {ROLLUP_TABLE}.sum + excluded.sum,
+        min = LEAST({ROLLUP_TABLE}.min, excluded.min),
+        max = GREATEST({ROLLUP_TABLE}.max, excluded.max)
+'''
+
+async def create_rollup_table(conn: Connection) -> None:
+    """Creates readings_1m if it does not exist yet"""
+    await conn.execute(CREATE_ROLLUP_TABLE)
+
+def aggregate(batch: np.ndarray) -> tuple[np.ndarray, ...]:
+    """
+    Folds a decoded batch (schemas.wire.WIRE_DTYPE) into per (id, minute) count/sum/min/max accumulators
+    Vectorized: one sort by (id, bucket), then each group is reduced with ufunc.reduceat instead of a Python loop
+    Returns (ids, bucket start in epoch seconds, count, sum, min, max) arrays, one element per group
+    """
+    buckets = batch['timestamp'] // BUCKET_US
+    order = np.lexsort((buckets, batch['id'])) # sorts by id, then bucket
+    ids = batch['id'][order]
+    buckets = buckets[order]
+    readings = batch['reading'][order].astype(np.int64)
+
+    starts = np.flatnonzero(np.r_[True, (ids[1:] != ids[:-1]) | (buckets[1:] != buckets[:-1])]) # first row of each group
+    counts = np.diff(np.r_[starts, len(ids)])
+    return (
+        ids[starts],
+        buckets[starts] * 60,
+        counts,
+        np.add.reduceat(readings, starts),
+        np.minimum.reduceat(readings, starts),
+        np.maximum.reduceat(readings, starts),
+    )
+
+async def upsert_rollups(conn: Connection, batch: np.ndarray) -> None:
+    """
+    Upserts the batch's accumulators into readings_1m with a single statement, run it in the same transaction as the COPY
+    The columns are sent as arrays and unnested server side, so there is one round trip however many groups there are
+    Rows are upserted in (id, bucket) order, like insert_from_staging_with_rollups, so concurrent flushers
+    (PIPELINE_FLUSHERS) lock overlapping readings_1m rows in the same order and can't deadlock
+    """
+    if not len(batch):
+        return
+    ids, buckets, counts, sums, minimums, maximums = aggregate(batch)
+    await conn.execute(f'''
+        INSERT INTO {ROLLUP_TABLE} (id, bucket, count, sum, min, max)
+        SELECT id, to_timestamp(bucket), count, sum, min, max
+        FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::bigint[], $5::smallint[], $6::smallint[])
+            AS batch(id, bucket, count, sum, min, max)
+        ORDER BY 1, 2
+        {MERGE_ROLLUPS}
+    ''', ids.tolist(), buckets.tolist(), counts.tolist(), sums.tolist(), minimums.tolist(), maximums.tolist())
+
+async def insert_from_staging_with_rollups(conn: Connection, table: str, staging: str) -> int:
+    """
+    insert_from_staging for a batch that also feeds readings_1m: only rows that were actually inserted
+    (not skipped as duplicates) are aggregated, by PostgreSQL in the same statement
+    Groups are upserted in (id, bucket) order, the same lock order as upsert_rollups
+    Returns the number of rows kept
+    """
+    return await conn.fetchval(f'''
+        WITH kept AS (
+            INSERT INTO {table} (id, reading, timestamp)
+            SELECT id, reading, timestamp FROM {staging}
+            ON CONFLICT DO NOTHING
+            RETURNING id, reading, timestamp
+        ), rollups AS (
+            INSERT INTO {ROLLUP_TABLE} (id, bucket, count, sum, min, max)
+            SELECT id, date_trunc('minute', timestamp), count(*), sum(reading), min(reading), max(reading)
+            FROM kept GROUP BY 1, 2 ORDER BY 1, 2
+            {MERGE_ROLLUPS}
+        )
+        SELECT count(*) FROM kept
+    ''')
@@ -0,0 +1,46 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+class Sink(ABC):
+    """
+    Somewhere the worker stores flushed batches, every sink gets every batch from the same stream read
+    write() stores one batch and returns the Redis ids that became durable in this sink with it. A sink that groups
+    batches (e.g. into files) can return ids of earlier batches too, or none yet
+    roll() is called periodically and close() once at shutdown, both also return the ids that became durable
+    """
+    @abstractmethod
+    async def write(self, redis_ids: list, data: list, batch: np.ndarray | None) -> list:
+        ...
+
+    async def roll(self) -> list:
+        return []
+
+    async def close(self) -> list:
+        return []
+
+class AckLedger:
+    """
+    Tracks which sinks hold each Redis id durably, an id may only be acknowledged once all of them do
+    Kept as a bitmask per id, so an entry delivered twice (e.g. reclaimed) can't be counted twice by the same sink
+    """
+    def __init__(self, sinks: int) -> None:
+        self.complete = (1 << sinks) - 1
+        self.durable: dict[str, int] = {} # redis id -> bitmask of sinks holding it
+
+    def record(self, sink: int, redis_ids: list) -> list:
+        """
+        Marks REDIS_IDS durable in sink number SINK, returns those that are now durable in every sink
+        """
+        if self.complete == 1: # a single sink needs no bookkeeping
+            return redis_ids
+        ready = []
+        bit = 1 << sink
+        for redis_id in redis_ids:
+            mask = self.durable.get(redis_id, 0) | bit
+            if mask == self.complete:
+                self.durable.pop(redis_id, None)
+                ready.append(redis_id)
+            else:
+                self.durable[redis_id] = mask
+        return ready
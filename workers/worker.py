@@ -1,107 +1,176 @@
-import signal
 import asyncio
-import logging
-from datetime import datetime
-from time import time_ns
+from time import time_ns, perf_counter
 
-from redis import exceptions
+import numpy as np
+from asyncpg import Pool, Connection
 from asyncpg.exceptions import UniqueViolationError
+from redis.exceptions import NoScriptError
 
 from config.redis_config import redis_client
 from config.config import settings
 from config.database_config import create_async_db_pool
-from config.log import setup_logger
+from schemas.wire import decode_entries
+from workers.core import logger, ensure_consumer_group, drain, copy_batch, copy_batch_skip_duplicates
+from config import tracing
+from config.metrics import timed_acquire, copy_seconds, xack_seconds
+from config.tracing import tracer
+from services.latest_cache import queue_latest, load_latest
+from workers.rollup import create_rollup_table, upsert_rollups
+from workers.sinks import Sink, AckLedger
+
+class PostgresSink(Sink):
+    """
+    The readings table, a batch is durable as soon as its COPY's transaction commits
+    Readings whose id already exists are skipped instead of failing the batch (see CONFLICT_MODE):
+    fallback tries the plain COPY first and only goes through the staging table if it hits a duplicate
+    With ROLLUP, the batch is also folded into per device per minute aggregates in readings_1m in the same transaction
+    """
+    def __init__(self, pool: Pool) -> None:
+        self.pool = pool
+
+    async def write(self, redis_ids: list, data: list, batch: np.ndarray | None) -> list:
+        async with timed_acquire(self.pool, 'worker') as conn:
+            start = perf_counter()
+            if settings.CONFLICT_MODE == 'staging':
+                await copy_skip_duplicates(conn, data, batch)
+            else:
+                try:
+                    async with conn.transaction():
+                            await copy_batch(conn, 'readings', data, batch=batch)
+                            if settings.ROLLUP:
+                                await upsert_rollups(conn, batch) # type: ignore
+                except UniqueViolationError: # the transaction was rolled back, redo the batch in a new one without the duplicates
+                    await copy_skip_duplicates(conn, data, batch)
+            copy_seconds.observe(perf_counter() - start, 'readings')
+        return redis_ids
+
+async def copy_skip_duplicates(conn: Connection, data: list, batch: np.ndarray | None = None) -> None:
+    """
+    Copies the batch through the staging table so duplicate ids are dropped and every other reading is kept
+    The whole batch, duplicates included, counts as durable since each of them is already in readings
+    """
+    async with conn.transaction():
+        kept = await copy_batch_skip_duplicates(conn, 'readings', data, batch, rollups=settings.ROLLUP)
+    if kept < len(data):
+        logger.warning(f'Batch of length {len(data)} kept {kept} readings and skipped {len(data) - kept} duplicate primary keys')
+        print(f'Batch of length {len(data)} kept {kept} readings and skipped {len(data) - kept} duplicate primary keys')
 
-running: bool = True # flag to shut down worker after FastAPI shutdown
+sinks: list[Sink] = [] # every flushed batch is written to each of these, see save_to_db
+ledger = AckLedger(1)
 
-def signal_shutdown(_sig, _frame) -> None:
+async def flush(pool: Pool, redis_ids: list, data: list) -> None:
     """
-    Stops the save_to_db loop
-    _sig and _frame are required by the signal module
+    Writes one batch of readings to every sink (the readings table, plus the columnar archive with ARCHIVE)
+    and acknowledges the entries that are now durable in all of them
+    With LATEST_CACHE, each device's newest reading is written to the latest value cache along with the XACK
+    POOL is held by the PostgresSink
     """
-    global running
-    running = False
-
-signal.signal(signal.SIGINT, signal_shutdown) # Catch CTRL+C
-signal.signal(signal.SIGTERM, signal_shutdown) # Catch kill command
+    batch = None
+    if settings.ROLLUP or settings.LATEST_CACHE or settings.ARCHIVE:
+        batch = decode_entries(data, settings.WIRE_FORMAT == 'binary') # decoded once, shared with a binary COPY
+
+    traced = tracer.sample()
+    try:
+        if traced:
+            tracer.record(tracing.BATCH, len(redis_ids))
+        ready = []
+        for index, sink in enumerate(sinks): # in order, so the archive only sees batches Postgres has committed
+            if traced:
+                tracer.record(tracing.COPY, len(redis_ids))
+            ready.extend(ledger.record(index, await sink.write(redis_ids, data, batch)))
+        if traced:
+            tracer.record(tracing.ACK, len(ready))
+        await acknowledge(ready, batch)
+        if traced:
+            tracer.record(tracing.BATCH_DONE, len(redis_ids))
+    except:
+        logger.error(f'Redis group failed to process {len(redis_ids)} requests, from request ID {redis_ids[0]} to {redis_ids[-1]} at time {time_ns()}')
+        raise
+
+async def roll_sinks(final: bool = False) -> None:
+    """
+    Lets every sink commit what it has been holding (on its own schedule, or everything if FINAL) and acknowledges
+    the entries that became durable in all of them
+    """
+    ready = []
+    for index, sink in enumerate(sinks):
+        ready.extend(ledger.record(index, await (sink.close() if final else sink.roll())))
+    await acknowledge(ready, None)
 
-logger: logging.Logger = setup_logger(settings.VERBOSE, settings.CLEAR_LOG)
+async def sink_maintenance(every: float) -> None:
+    """
+    Runs roll_sinks every EVERY seconds until cancelled, so a time rolled file is committed even if no new batches arrive
+    """
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await roll_sinks()
+        except Exception as e:
+            logger.error(f'Rolling sinks failed: {e}')
+
+async def acknowledge(redis_ids: list, batch: np.ndarray | None) -> None:
+    """
+    Acknowledges entries that are durable in every sink, only after they are committed, so a failed commit is re-read
+    With LATEST_CACHE, the flushed batch's newest reading per device goes to the latest value cache in the same MULTI/EXEC
+    """
+    start = perf_counter()
+    if not settings.LATEST_CACHE or batch is None:
+        if redis_ids:
+            await redis_client.xack(settings.STREAM_NAME, settings.CONSUMER_GROUP, *redis_ids) # important: acknowledges completing the task(s) to clear from pending entries list
+    else:
+        try:
+            await acknowledge_with_latest(redis_ids, batch)
+        except NoScriptError: # Redis lost its script cache (e.g. it restarted), both commands are safe to repeat
+            await load_latest(redis_client)
+            await acknowledge_with_latest(redis_ids, batch)
+    if redis_ids:
+        xack_seconds.observe(perf_counter() - start)
+
+async def acknowledge_with_latest(redis_ids: list, batch: np.ndarray) -> None:
+    """
+    XACK and the latest value cache update in one MULTI/EXEC round trip
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        queue_latest(pipe, settings.LATEST_HASH, batch)
+        if redis_ids:
+            pipe.xack(settings.STREAM_NAME, settings.CONSUMER_GROUP, *redis_ids)
+        await pipe.execute()
 
 async def save_to_db() -> None:
     """
-    Read from Redis stream
-    Returns a maximum of 1000 requests at a time
-    Waits 5 seconds if no messages have been added to the stream
-    Waits for BUFFER requests to accumulate or BUFFER_TIME second to pass
-    Acquires asyncpg connection pool
-    Bulk copies readings into readings table
+    Creates the consumer group if needed and the asyncpg connection pool (and readings_1m with ROLLUP)
+    Drains the Redis stream into the readings table, and the columnar archive with ARCHIVE, until shutdown (see workers/core.py)
     """
-    try: # create consumer group if it does not already exist
-        await redis_client.xgroup_create(settings.STREAM_NAME, settings.CONSUMER_GROUP, id='0', mkstream=True)
-    except exceptions.ResponseError as e:
-        if "Consumer Group name already exists" not in str(e): # if the exception doesn't have to do with the consumer group already existing, raise
-            raise
-
-    # create buffers
-    redis_ids = [] # capture Redis auto generated IDs, e.g. 1656416957625-0.
-    data = [] # capture data from each payload
-    last_flush = datetime.now() # starts the timer for clearing the buffer after BUFFER_TIME seconds elapse
+    global ledger
+    await ensure_consumer_group()
+    if settings.LATEST_CACHE:
+        await load_latest(redis_client) # queue_latest only sends the script's SHA
 
     pool = await create_async_db_pool(USER=settings.USER, DATABASE=settings.DATABASE,
                             HOST=settings.HOST, PORT=settings.PORT, DATABASE_PASS=settings.DATABASE_PASS,
                             MIN_SIZE=settings.MIN_SIZE, MAX_SIZE=settings.MAX_SIZE)
-
-    while running: # worker loop
-        readings = await redis_client.xreadgroup(settings.CONSUMER_GROUP, 
-                                        settings.CONSUMER_NAME, 
-                                        {settings.STREAM_NAME: '>'}, # '>' means worker only reads from latest messages in the stream and adds to PEL util xack
-                                        count=1000, # read up to 1000 messages at a time
-                                        block=5000) # worker will wait for messages for up to 5 seconds before returning empty
-        if not readings:
-            continue
-
-        # collect all of the readings and separate out redis ids (for acknowledgement) from data (for processing)
-        for _, messages in readings: # type: ignore
-            for message_id, payload in messages:
-                redis_ids.append(message_id)
-                data.append(payload)
-            
-        if (len(redis_ids) > settings.BUFFER) or ((datetime.now() - last_flush).total_seconds() > settings.BUFFER_TIME): # clears the buffer when BUFFER capacity is hit or BUFFER_TIME is reached
-
-            records = [(int(r['id']), int(r['reading']), datetime.fromisoformat(r['timestamp'])) for r in data] # make sure data is in correct format for postgres
-
-            try:
-                async with pool.acquire() as conn:
-                    async with conn.transaction():
-                            await conn.copy_records_to_table(
-                                'readings',
-                                records=records,
-                                columns=('id', 'reading', 'timestamp')
-                            ) # uses PostgreSQL's COPY protocol, which is faster than individual inserts
-                            await redis_client.xack(settings.STREAM_NAME, settings.CONSUMER_GROUP, *redis_ids) # important: acknowledges completing the task(s) to clear from pending entries list
-                            
-                            # clear the buffers
-                            redis_ids.clear()
-                            data.clear()
-
-                            last_flush = datetime.now() # restart the timer
-
-            except UniqueViolationError as e: # catches duplicate primary key errors gracefully, skipping batch instead of crashing worker
-                logger.error(f'Duplicate primary key found, skipping this batch of length {len(redis_ids)}')
-                print(f'Duplicate primary key found, skipping this batch of length {len(redis_ids)}')
-                
-                # clears the buffer to avoid retrying failed group
-                redis_ids.clear()
-                data.clear()
-            except:
-                logger.error(f'Redis group failed to process {len(redis_ids)} requests, from request ID {redis_ids[0]} to {redis_ids[-1]} at time {time_ns()}')
-                raise
-
+    if settings.ROLLUP:
+        async with pool.acquire() as conn:
+            await create_rollup_table(conn)
+
+    sinks.append(PostgresSink(pool))
+    if settings.ARCHIVE:
+        from workers.archive import ArchiveSink # needs pyarrow, only imported when archiving
+        if settings.ARCHIVE_MAX_AGE >= settings.CLAIM_MIN_IDLE:
+            logger.warning(f'ARCHIVE_MAX_AGE ({settings.ARCHIVE_MAX_AGE}s) should be below CLAIM_MIN_IDLE ({settings.CLAIM_MIN_IDLE}s), '
+                           'entries waiting for their archive file would be reclaimed and written twice')
+        sinks.append(ArchiveSink(settings.ARCHIVE_DIR, settings.CONSUMER_NAME, settings.ARCHIVE_FORMAT,
+                                 settings.ARCHIVE_ROW_GROUP, settings.ARCHIVE_MAX_ROWS, settings.ARCHIVE_MAX_AGE))
+    ledger = AckLedger(len(sinks))
+
+    roller = asyncio.create_task(sink_maintenance(1)) if len(sinks) > 1 else None
+    await drain(pool, flush)
+    if roller is not None:
+        roller.cancel()
+    await roll_sinks(final=True) # commit the open archive file so its entries are acknowledged
     print('Shutting down worker')
-    if settings.CLEAR_STREAM:
-        await redis_client.delete(settings.STREAM_NAME) # delete the stream key if set in config
 
 if __name__ == '__main__':
     print('Starting worker')
     print('Writing to readings database')
-    asyncio.run(save_to_db())
\ No newline at end of file
+    asyncio.run(save_to_db())